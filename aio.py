@@ -0,0 +1,269 @@
+import asyncio
+import collections
+import io
+import zlib
+
+import idat
+from chunk import Chunk
+from parsers import parse_IHDR
+from reader import PNG_SIGNATURE
+
+
+READ_SIZE = 65536
+
+# payloads up to this size are checked on the event loop, larger ones in the executor
+OFFLOAD_BYTES = 64 << 10
+
+DEFAULT_BUDGET = 256 << 20
+
+
+def stream_reader(source):
+  """Returns an async read(size) of bytes, an asyncio.StreamReader or an
+  async iterable of bytes, such as the body of an upload.
+  """
+  if isinstance(source, (bytes, bytearray, memoryview)):
+    view = memoryview(source)
+    position = 0
+
+    async def read(size):
+      nonlocal position
+      part = bytes(view[position:position+size])
+      position += len(part)
+      return part
+    return read
+  if hasattr(source, "read"):
+    return source.read
+  pieces = source.__aiter__()
+  buffer = bytearray()
+
+  async def read(size):
+    # one piece is buffered at a time, the source is only pulled when it's used up
+    if not buffer:
+      try:
+        buffer.extend(await pieces.__anext__())
+      except StopAsyncIteration:
+        return b""
+    part = bytes(buffer[:size])
+    del buffer[:size]
+    return part
+  return read
+
+
+async def read_exact(read, size):
+  parts = []
+  while size > 0:
+    part = await read(size)
+    if not part:
+      break
+    parts.append(part)
+    size -= len(part)
+  return b"".join(parts)
+
+
+async def skip(read, size, buffer_size):
+  while size > 0:
+    part = await read(min(size, buffer_size))
+    if not part:
+      return False
+    size -= len(part)
+  return True
+
+
+async def aiter_chunks(read, keep=None, reserve=None, buffer_size=READ_SIZE):
+  """Async counterpart of reader.iter_chunks, yields (Chunk, payload) pairs
+  as the chunks arrive from read.
+
+  Only the payloads of chunks for which keep(chunk) is true are read into
+  memory (all of them when keep is None), the others are drained in
+  buffer_size pieces and yielded with a None payload. reserve is awaited
+  with a payload's size before the payload is read, so a full budget stops
+  reading from the source. Raises ValueError on a bad signature or a
+  truncated stream.
+  """
+  if await read_exact(read, 8) != PNG_SIGNATURE:
+    raise ValueError("Bad png file signature.")
+  start = 8
+  while True:
+    header = await read_exact(read, 8)
+    if not header:
+      return
+    if len(header) < 8:
+      raise ValueError("Unexpected end of stream.")
+    datasize = int.from_bytes(header[0:4], byteorder="big", signed=False)
+    name = header[4:8].decode("latin-1")
+    chunk = Chunk(start, name, datasize)
+    if keep is None or keep(chunk):
+      if reserve is not None:
+        await reserve(datasize)
+      payload = await read_exact(read, datasize)
+      if len(payload) < datasize:
+        raise ValueError("Unexpected end of stream.")
+    else:
+      payload = None
+      if not await skip(read, datasize, buffer_size):
+        raise ValueError("Unexpected end of stream.")
+    crc = await read_exact(read, 4)
+    if len(crc) < 4:
+      raise ValueError("Unexpected end of stream.")
+    chunk.crc = int.from_bytes(crc, byteorder="big", signed=False)
+    yield chunk, payload
+    start = start + 8 + datasize + 4
+    if name == "IEND":
+      return
+
+
+class ByteBudget:
+  """Bytes of chunk payloads that all images being ingested may hold at once.
+
+  acquire() waits while the budget is used up, which stops the waiting
+  image from reading its source and lets the transport push back on the
+  sender. The oldest image holding bytes never waits, otherwise images
+  that each hold part of the budget could wait on each other forever, so
+  the budget is exceeded by at most that one image.
+  """
+  def __init__(self, limit=DEFAULT_BUDGET):
+    self.limit = limit
+    self.used = 0
+    self.peak = 0
+    # bytes held per reservation, oldest first
+    self.holders = collections.OrderedDict()
+    self.released = asyncio.Event()
+
+  def reservation(self):
+    return Reservation(self)
+
+  def can_take(self, reservation, size):
+    return self.used + size <= self.limit or next(iter(self.holders), reservation) is reservation
+
+  async def acquire(self, reservation, size):
+    while not self.can_take(reservation, size):
+      await self.released.wait()
+    self.used += size
+    self.peak = max(self.peak, self.used)
+    self.holders[reservation] = self.holders.get(reservation, 0) + size
+
+  def release(self, reservation, size=None):
+    held = self.holders.get(reservation)
+    if held is None:
+      return
+    size = held if size is None else min(size, held)
+    self.used -= size
+    if held > size:
+      self.holders[reservation] = held - size
+    else:
+      del self.holders[reservation]
+    # wakes everyone waiting on the current event, later waiters get a new one
+    self.released.set()
+    self.released = asyncio.Event()
+
+
+class Reservation:
+  """The share of a ByteBudget held by one image."""
+  def __init__(self, budget):
+    self.budget = budget
+
+  async def acquire(self, size):
+    await self.budget.acquire(self, size)
+
+  def release(self, size=None):
+    self.budget.release(self, size)
+
+
+def chunk_crc(name, payload):
+  return zlib.crc32(payload, zlib.crc32(name.encode("latin-1")))
+
+
+def encrypt_png(data, public_key, bits=1024, mode="ECB", iv=0):
+  """Encrypted copy of a png held in memory, see PNG_Image.encrypt."""
+  from image import PNG_Image
+  img = PNG_Image(None, data=data)
+  img.encrypt(public_key, bits, mode, iv, workers=1)
+  return bytes(img.data)
+
+
+async def write(out, *parts):
+  for part in parts:
+    out.write(part)
+  drain = getattr(out, "drain", None)
+  if drain is not None:
+    await drain()
+
+
+class Ingestor:
+  """Validates, strips and optionally encrypts pngs as they are received.
+
+  ingest() parses chunk headers as the bytes arrive, checks every kept
+  chunk's CRC, inflates the IDAT stream to check it and drops ancillary
+  chunks not listed in allow. CRCs of large payloads, inflating and
+  encryption run in executor (the loop's default thread pool when None);
+  zlib releases the GIL, RSA doesn't, so pass a ProcessPoolExecutor when
+  encrypting. Many ingest() calls can run concurrently, their payloads
+  share one ByteBudget of budget bytes.
+  """
+  def __init__(self, budget=DEFAULT_BUDGET, executor=None, allow=(), strip=True):
+    self.budget = ByteBudget(budget)
+    self.executor = executor
+    self.allow = allow
+    self.strip = strip
+
+  async def run(self, func, *args):
+    return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+  async def run_sized(self, size, func, *args):
+    # small payloads cost less than the round trip to the executor
+    if size <= OFFLOAD_BYTES:
+      return func(*args)
+    return await self.run(func, *args)
+
+  def keeps(self, chunk):
+    return not (self.strip and chunk.is_ancillary() and chunk.name not in self.allow)
+
+  async def ingest(self, source, out=None, public_key=None, bits=1024, mode="ECB", iv=0):
+    """Ingests one png from source and returns its record.
+
+    The kept chunks are written to out, a file object or an
+    asyncio.StreamWriter, as soon as they are checked; with out None they
+    are returned as the record's "data". Encrypting with public_key holds
+    the whole image until IEND, both it and collecting into "data" keep
+    the image's share of the budget until ingest() returns.
+    """
+    read = stream_reader(source)
+    reservation = self.budget.reservation()
+    collected = io.BytesIO() if out is None else None
+    final = collected if out is None else out
+    buffered = io.BytesIO() if public_key is not None else None
+    target = final if buffered is None else buffered
+    inflater = idat.Inflater()
+    record = {"chunks": [], "ihdr": None, "dropped_chunks": [], "corrupt_chunks": []}
+    try:
+      await write(target, PNG_SIGNATURE)
+      async for chunk, payload in aiter_chunks(read, self.keeps, reservation.acquire):
+        record["chunks"].append({"name": chunk.name, "start": chunk.start, "datasize": chunk.datasize})
+        if payload is None:
+          record["dropped_chunks"].append({"name": chunk.name, "start": chunk.start})
+          continue
+        if await self.run_sized(len(payload), chunk_crc, chunk.name, payload) != chunk.crc:
+          record["corrupt_chunks"].append({"name": chunk.name, "start": chunk.start})
+        if chunk.name == "IHDR" and len(payload) >= 13:
+          record["ihdr"] = parse_IHDR(payload)
+        elif chunk.name == "IDAT":
+          await self.run_sized(len(payload), inflater.feed, payload)
+        await write(target,
+                    chunk.datasize.to_bytes(4, byteorder="big"), chunk.name.encode("latin-1"),
+                    payload, chunk.crc.to_bytes(4, byteorder="big"))
+        if target is out:
+          reservation.release()
+      record["idat_ok"] = inflater.finish()
+      record["inflated_size"] = inflater.size
+      if buffered is not None:
+        data = buffered.getvalue()
+        await reservation.acquire(len(data))
+        data = await self.run(encrypt_png, data, public_key, bits, mode, iv)
+        await write(final, data)
+      if collected is not None:
+        record["data"] = collected.getvalue()
+    except (IOError, ValueError, zlib.error) as e:
+      record["error"] = str(e)
+    finally:
+      reservation.release()
+    return record
@@ -0,0 +1,281 @@
+import argparse
+import contextlib
+import fnmatch
+import io
+import json
+import os
+import platform
+import secrets
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+
+import numpy as np
+
+import myrsa
+import rsa
+import rsa_engine
+from chunk import chunk_bytes
+from decoder import CHANNELS, decode_image
+from image import PNG_Image
+from reader import PNG_SIGNATURE
+from spectrum import SpectrumEngine
+from strip import strip_metadata
+
+
+def make_png(path, width=512, height=512, color_type=2, bit_depth=8, text_chunks=8, idat_size=8192, seed=0):
+  """Writes a synthetic png file and returns its path.
+
+  Pixels are a gradient with noise so they compress roughly like a photo,
+  scanlines cycle through all five filter types and the image data is
+  split into IDAT chunks of idat_size bytes. text_chunks tEXt chunks give
+  the metadata benchmarks something to work on.
+  """
+  rng = np.random.default_rng(seed)
+  row_bytes = (width * CHANNELS[color_type] * bit_depth + 7) // 8
+  gradient = np.add.outer(np.arange(height), np.arange(row_bytes)).astype(np.uint8)
+  rows = gradient + rng.integers(0, 16, size=(height, row_bytes), dtype=np.uint8)
+  filter_types = (np.arange(height, dtype=np.uint8) % 5)[:, None]
+  compressed = zlib.compress(np.hstack((filter_types, rows)).tobytes())
+
+  ihdr = width.to_bytes(4, "big") + height.to_bytes(4, "big") + bytes([bit_depth, color_type, 0, 0, 0])
+  chunks = [chunk_bytes("IHDR", ihdr)]
+  if color_type == 3:
+    chunks.append(chunk_bytes("PLTE", rng.integers(0, 256, size=3 * (1 << bit_depth), dtype=np.uint8).tobytes()))
+  for i in range(text_chunks):
+    chunks.append(chunk_bytes("tEXt", b"Comment\x00" + secrets.token_hex(32 + i).encode("latin-1")))
+  for i in range(0, len(compressed), idat_size):
+    chunks.append(chunk_bytes("IDAT", compressed[i:i+idat_size]))
+  chunks.append(chunk_bytes("IEND", b""))
+  with open(path, "wb") as f:
+    f.write(PNG_SIGNATURE + b"".join(chunks))
+  return path
+
+
+def percentile(values, q):
+  values = sorted(values)
+  position = (len(values) - 1) * q
+  low = int(position)
+  high = min(low + 1, len(values) - 1)
+  return values[low] + (values[high] - values[low]) * (position - low)
+
+
+# modules that headless chunk inspection imports, with their import time budget
+HEADLESS_MODULES = ("image", "reader", "strip")
+
+IMPORT_BUDGET = 0.05
+
+
+def measure(func, setup=None, warmup=1, repeat=5, ops=None, self_timed=False):
+  """Times func(state) where state comes from a fresh setup() every run.
+
+  Setup is not timed. The first warmup runs are discarded, peak memory is
+  taken from one extra run under tracemalloc so that tracing does not
+  slow down the timed runs. A self_timed func returns its own duration.
+  """
+  setup = setup or (lambda: None)
+  times = []
+  for i in range(warmup + repeat):
+    state = setup()
+    start = time.perf_counter()
+    elapsed = func(state)
+    if not self_timed:
+      elapsed = time.perf_counter() - start
+    if i >= warmup:
+      times.append(elapsed)
+  state = setup()
+  tracemalloc.start()
+  try:
+    func(state)
+    _, peak = tracemalloc.get_traced_memory()
+  finally:
+    tracemalloc.stop()
+
+  result = {
+    "repeat": repeat,
+    "min": min(times),
+    "median": statistics.median(times),
+    "mean": statistics.mean(times),
+    "p90": percentile(times, 0.9),
+    "max": max(times),
+    "stdev": statistics.stdev(times) if len(times) > 1 else 0.0,
+    "peak_bytes": peak,
+  }
+  if ops:
+    result["ops"] = ops
+    result["ops_per_second"] = ops / result["median"]
+  return result
+
+
+def import_time(module):
+  """Cumulative import time of module in a fresh interpreter, from -X importtime."""
+  result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          capture_output=True, text=True, check=True,
+                          cwd=os.path.dirname(os.path.abspath(__file__)))
+  for line in result.stderr.splitlines():
+    fields = line.split("|")
+    if len(fields) == 3 and fields[2].strip() == module:
+      return int(fields[1]) / 1e6
+  raise ValueError(f"No import time reported for {module}.")
+
+
+def import_benchmarks(modules):
+  for module in modules:
+    yield f"import-{module}", lambda _, module=module: import_time(module), None, None
+
+
+def image_benchmarks(path, workdir):
+  stripped = os.path.join(workdir, "stripped.png")
+  yield "index", lambda _: PNG_Image(path), None, None
+  yield "index-mmap", lambda _: PNG_Image(path, use_mmap=True).close(), None, None
+  yield "strip", lambda _: strip_metadata(path, stripped), None, None
+  yield "insert", lambda img: img.insert_chunk(1, "tEXt", b"Comment\x00benchmark"), lambda: PNG_Image(path), None
+  yield "delete", lambda img: img.delete_chunks_named("tEXt"), lambda: PNG_Image(path), None
+  yield "verify-crcs", lambda img: img.verify_crcs(), lambda: PNG_Image(path), None
+  yield "decode", decode_image, lambda: PNG_Image(path), None
+  yield "recompress", lambda img: img.recompress(), lambda: PNG_Image(path), None
+  pixels = decode_image(PNG_Image(path), as_uint8=True)
+  # the transform stage of GUI.make_fig, without the figure
+  def spectrum(engine):
+    result = engine.get("bench.png", pixels)
+    return result.log_magnitude(), result.phase()
+  yield "fft", spectrum, SpectrumEngine, None
+  warm = SpectrumEngine()
+  spectrum(warm)
+  yield "fft-cached", spectrum, lambda: warm, None
+
+
+def rsa_benchmarks(path, bits, workers):
+  public, private = myrsa.generate_keys(bits)
+  for mode in ("ECB", "CBC"):
+    def encrypted(mode=mode):
+      img = PNG_Image(path)
+      img.encrypt(public, bits, mode, workers=workers)
+      return img
+    yield f"rsa-{mode.lower()}-encrypt", lambda img, mode=mode: img.encrypt(public, bits, mode, workers=workers), lambda: PNG_Image(path), None
+    yield f"rsa-{mode.lower()}-decrypt", lambda img, mode=mode: img.decrypt(private, bits, mode, workers=workers), encrypted, None
+
+
+def block_benchmarks(bits, n_blocks):
+  public, private = myrsa.generate_keys(bits)
+  blocks = [secrets.randbits(bits - 8) for _ in range(n_blocks)]
+  ciphertexts = list(rsa_engine.encrypt_blocks(blocks, public, workers=1))
+  yield f"blocks-{bits}-encrypt", lambda _: list(rsa_engine.encrypt_blocks(blocks, public, workers=1)), None, n_blocks
+  yield f"blocks-{bits}-decrypt", lambda _: list(rsa_engine.decrypt_blocks(ciphertexts, private[:2], workers=1)), None, n_blocks
+  yield f"blocks-{bits}-crt", lambda _: list(rsa_engine.decrypt_blocks(ciphertexts, private, workers=1)), None, n_blocks
+  yield f"blocks-{bits}-crt-pool", lambda _: list(rsa_engine.decrypt_blocks(ciphertexts, private)), None, n_blocks
+
+
+def keygen_benchmarks(bit_lengths):
+  for bits in bit_lengths:
+    yield f"keygen-{bits}-myrsa", lambda _, bits=bits: myrsa.generate_keys(bits), None, None
+    yield f"keygen-{bits}-rsa", lambda _, bits=bits: rsa.newkeys(bits), None, None
+
+
+def run(args):
+  workdir = tempfile.mkdtemp(prefix="png-bench-")
+  path = make_png(os.path.join(workdir, "bench.png"), args.size, args.size, args.color_type,
+                  text_chunks=args.chunks, idat_size=args.idat_size)
+  rsa_path = make_png(os.path.join(workdir, "rsa.png"), args.rsa_size, args.rsa_size, args.color_type,
+                      text_chunks=args.chunks, idat_size=args.idat_size)
+  groups = (
+    lambda: import_benchmarks(HEADLESS_MODULES),
+    lambda: image_benchmarks(path, workdir),
+    lambda: rsa_benchmarks(rsa_path, args.rsa_bits, args.workers),
+    lambda: block_benchmarks(args.rsa_bits, args.blocks),
+    lambda: keygen_benchmarks(args.keygen_bits),
+  )
+  results = {}
+  out = sys.stdout
+  # the library reports indexing and edits on stdout
+  with contextlib.redirect_stdout(io.StringIO()):
+    for group in groups:
+      for name, func, setup, ops in group():
+        if args.only and not any(fnmatch.fnmatch(name, pattern) for pattern in args.only):
+          continue
+        results[name] = measure(func, setup, args.warmup, args.repeat, ops, self_timed=name.startswith("import-"))
+        print_result(name, results[name], out)
+  return results
+
+
+def print_result(name, result, file=None):
+  line = "{:<24}{:>12.3f}{:>12.3f}{:>12.3f}{:>12.2f}".format(
+    name, 1000*result["median"], 1000*result["p90"], 1000*result["min"], result["peak_bytes"]/(1 << 20))
+  if "ops_per_second" in result:
+    line += "{:>12.1f}".format(result["ops_per_second"])
+  print(line, file=file, flush=True)
+
+
+def compare(results, baseline, threshold):
+  """Prints median ratios against a saved run, returns the regressed names."""
+  print()
+  print("{:<24}{:>12}{:>12}{:>10}".format("benchmark", "before ms", "after ms", "ratio"))
+  regressions = []
+  for name, result in results.items():
+    if name not in baseline:
+      continue
+    ratio = result["median"] / baseline[name]["median"]
+    flag = ""
+    if ratio > 1 + threshold:
+      regressions.append(name)
+      flag = "  REGRESSION"
+    elif ratio < 1 - threshold:
+      flag = "  faster"
+    print("{:<24}{:>12.3f}{:>12.3f}{:>10.2f}{}".format(
+      name, 1000*baseline[name]["median"], 1000*result["median"], ratio, flag))
+  return regressions
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(prog="bench", description="Benchmarks of the png inspector.")
+  parser.add_argument("-o", "--output", help="write the results to this JSON file")
+  parser.add_argument("--compare", help="JSON file of an earlier run to compare against")
+  parser.add_argument("--threshold", type=float, default=0.10, help="median slowdown reported as a regression")
+  parser.add_argument("--only", nargs="+", help="run only benchmarks matching these patterns, e.g. 'rsa-*'")
+  parser.add_argument("--repeat", type=int, default=5)
+  parser.add_argument("--warmup", type=int, default=1)
+  parser.add_argument("--size", type=int, default=1024, help="width and height of the synthetic image")
+  parser.add_argument("--color-type", type=int, default=2, choices=sorted(CHANNELS))
+  parser.add_argument("--chunks", type=int, default=32, help="number of tEXt chunks")
+  parser.add_argument("--idat-size", type=int, default=8192)
+  parser.add_argument("--rsa-size", type=int, default=64, help="width and height of the image for RSA")
+  parser.add_argument("--rsa-bits", type=int, default=1024)
+  parser.add_argument("--blocks", type=int, default=2048, help="blocks for the RSA block throughput")
+  parser.add_argument("--keygen-bits", type=int, nargs="*", default=[128, 256, 512, 1024, 2048])
+  parser.add_argument("-j", "--workers", type=int, default=None)
+  parser.add_argument("--import-budget-ms", type=float, default=1000*IMPORT_BUDGET,
+                      help="median import time allowed for the headless modules")
+  args = parser.parse_args(argv)
+
+  print("{:<24}{:>12}{:>12}{:>12}{:>12}{:>12}".format("benchmark", "median ms", "p90 ms", "min ms", "peak MiB", "ops/s"))
+  results = run(args)
+  if args.output:
+    with open(args.output, "w") as f:
+      json.dump({
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "time": time.time(),
+        "args": vars(args),
+        "results": results,
+      }, f, indent=2)
+  status = 0
+  for module in HEADLESS_MODULES:
+    result = results.get(f"import-{module}")
+    if result is not None and result["median"] > args.import_budget_ms / 1000:
+      print(f"import {module} takes {1000*result['median']:.1f} ms, over the {args.import_budget_ms:g} ms budget")
+      status = 1
+  if args.compare:
+    with open(args.compare) as f:
+      baseline = json.load(f)["results"]
+    if compare(results, baseline, args.threshold):
+      status = 1
+  return status
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -1,11 +1,27 @@
+import binascii
+
+
 class Chunk:
-  def __init__(self, start, name, datasize):
+  __slots__ = ("start", "name", "datasize", "crc")
+
+  def __init__(self, start, name, datasize, crc=None):
     self.start = start
     self.name = name
     self.datasize = datasize
+    self.crc = crc
 
   def __str__(self):
     text = '{0:16}{1}\n'.format("chunk name:", self.name)
     text += '{0:16}{1}\n'.format("starting index:", self.start)
     text += '{0:16}{1}\n'.format("size of data:", self.datasize)
     return text
+
+  def is_ancillary(self):
+    return ord(self.name[0]) > 96
+
+
+def chunk_bytes(name, data):
+  size = int.to_bytes(len(data), 4, byteorder='big', signed=False)
+  uni_name = bytes([ord(c) for c in name])
+  crc = int.to_bytes(binascii.crc32(data, binascii.crc32(uni_name)), 4, byteorder='big', signed=False)
+  return size + uni_name + bytes(data) + crc
@@ -0,0 +1,209 @@
+import argparse
+import functools
+import json
+import mmap
+import multiprocessing
+import os
+import sys
+import zlib
+
+import crc
+from parsers import parse_IHDR
+from reader import PNG_SIGNATURE, iter_chunks
+
+
+def iter_png_paths(folder):
+  for root, dirs, files in os.walk(folder):
+    dirs.sort()
+    for f in sorted(files):
+      if f.lower().endswith((".png")):
+        yield os.path.join(root, f)
+
+
+def make_record(filepath, size, chunks, ihdr, signature_ok=True):
+  return {
+    "path": filepath,
+    "size": size,
+    "signature_ok": signature_ok,
+    "chunks": [{"name": chunk.name, "start": chunk.start, "datasize": chunk.datasize} for chunk in chunks],
+    "ihdr": ihdr,
+  }
+
+
+def scan_file(filepath, verify_crcs=False):
+  chunks = []
+  ihdr = None
+  signature_ok = False
+  error = None
+  size = None
+  corrupt = []
+  try:
+    size = os.path.getsize(filepath)
+    with open(filepath, "rb") as f:
+      signature_ok = f.read(8) == PNG_SIGNATURE
+      f.seek(0)
+      for chunk, payload in iter_chunks(f, names=("IHDR",)):
+        chunks.append(chunk)
+        if chunk.name == "IHDR" and len(payload) >= 13:
+          ihdr = parse_IHDR(payload)
+    if verify_crcs and chunks:
+      with open(filepath, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        corrupt = crc.verify_crcs(data, chunks, threads=1)
+  except (IOError, ValueError) as e:
+    error = str(e)
+  record = make_record(filepath, size, chunks, ihdr, signature_ok)
+  if verify_crcs:
+    record["corrupt_chunks"] = [{"name": chunk.name, "start": chunk.start} for chunk in corrupt]
+  if error is not None:
+    record["error"] = error
+  return record, chunks
+
+
+def scan(args):
+  out = open(args.output, "w") if args.output else sys.stdout
+  cache = None
+  if args.cache:
+    from index_cache import IndexCache
+    # committed once per batch of records, not once per file
+    cache = IndexCache(args.cache, batch_size=args.batch)
+  try:
+    paths = iter_png_paths(args.folder)
+    if cache is not None and not args.verify_crcs:
+      # answer unchanged files from the cache, only the rest go to the pool
+      misses = []
+      for filepath in paths:
+        try:
+          st = os.stat(filepath)
+        except OSError:
+          st = None
+        cached = cache.get(filepath, st) if st else None
+        if cached is None:
+          misses.append(filepath)
+        else:
+          chunks, fields = cached
+          record = make_record(filepath, st.st_size, chunks, fields.get("IHDR"))
+          out.write(json.dumps(record) + "\n")
+      paths = misses
+    with multiprocessing.Pool(args.workers) as pool:
+      worker = functools.partial(scan_file, verify_crcs=args.verify_crcs)
+      for record, chunks in pool.imap_unordered(worker, paths, chunksize=args.batch):
+        out.write(json.dumps(record) + "\n")
+        if cache is not None and "error" not in record:
+          cache.put(record["path"], chunks, {"IHDR": record["ihdr"]})
+  finally:
+    if cache is not None:
+      cache.close()
+    if out is not sys.stdout:
+      out.close()
+  return 0
+
+
+def hash_path(filepath):
+  from dedup import hash_file
+  try:
+    st = os.stat(filepath)
+    return filepath, st, hash_file(filepath), None
+  except (IOError, ValueError) as e:
+    return filepath, None, None, str(e)
+
+
+def dedup(args):
+  from dedup import DedupIndex, group_paths
+  out = open(args.output, "w") if args.output else sys.stdout
+  # committed once per batch of files, not once per file
+  index = DedupIndex(args.index, batch_size=args.batch) if args.index else DedupIndex(batch_size=args.batch)
+  digests = {}
+  errors = 0
+  try:
+    # unchanged files keep their digest, only the rest are read
+    misses = []
+    for filepath in iter_png_paths(args.folder):
+      digest = index.get(filepath)
+      if digest is None:
+        misses.append(filepath)
+      else:
+        digests[filepath] = digest
+    with multiprocessing.Pool(args.workers) as pool:
+      for filepath, st, digest, error in pool.imap_unordered(hash_path, misses, chunksize=args.batch):
+        if error is not None:
+          errors += 1
+          print(filepath, "-", error, file=sys.stderr)
+          continue
+        digests[filepath] = digest
+        index.put(filepath, digest, st)
+    groups = group_paths(digests)
+    for paths in groups:
+      if len(paths) > 1 or args.all:
+        # the first path stands for the group, strip or encrypt that one only
+        out.write(json.dumps({"digest": digests[paths[0]], "paths": paths}) + "\n")
+  finally:
+    index.close()
+    if out is not sys.stdout:
+      out.close()
+  print(len(digests), "files,", len(groups), "unique,", len(misses), "hashed,", errors, "failed.", file=sys.stderr)
+  return 0
+
+
+def positive_int(text, limit=2**31 - 1):
+  # png chunk lengths are at most 2**31 - 1
+  value = int(text)
+  if not 0 < value <= limit:
+    raise argparse.ArgumentTypeError(f"{text} is not between 1 and {limit}")
+  return value
+
+
+def recompress(args):
+  from image import PNG_Image
+  if not os.access(args.src, os.R_OK):
+    print(args.src, "- cannot read file", file=sys.stderr)
+    return 1
+  img = PNG_Image(args.src)
+  if not img.chunks:
+    return 1
+  try:
+    img.recompress(args.level, args.chunk_size, args.workers, args.block_size << 10)
+  except (ValueError, zlib.error) as e:
+    print(args.src, "-", e, file=sys.stderr)
+    return 1
+  img.save(args.dst)
+  return 0
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(prog="png-inspector")
+  commands = parser.add_subparsers(dest="command", required=True)
+
+  scan_parser = commands.add_parser("scan", help="index every png in a directory tree, one NDJSON record per file")
+  scan_parser.add_argument("folder")
+  scan_parser.add_argument("-o", "--output", help="write records here instead of stdout")
+  scan_parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: all cores)")
+  scan_parser.add_argument("--batch", type=int, default=64, help="files handed to a worker at a time")
+  scan_parser.add_argument("--cache", help="sqlite chunk index cache, unchanged files are not re-read")
+  scan_parser.add_argument("--verify-crcs", action="store_true", help="check every chunk's crc and list the corrupt ones")
+  scan_parser.set_defaults(func=scan)
+
+  dedup_parser = commands.add_parser("dedup", help="group the pngs in a directory tree by image content, one NDJSON record per group")
+  dedup_parser.add_argument("folder")
+  dedup_parser.add_argument("-o", "--output", help="write groups here instead of stdout")
+  dedup_parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: all cores)")
+  dedup_parser.add_argument("--batch", type=int, default=64, help="files handed to a worker at a time")
+  dedup_parser.add_argument("--index", help="sqlite content index (default: ~/.png_inspector/dedup.sqlite)")
+  dedup_parser.add_argument("--all", action="store_true", help="also list files without duplicates")
+  dedup_parser.set_defaults(func=dedup)
+
+  recompress_parser = commands.add_parser("recompress", help="deflate the image data of a png again, on all cores")
+  recompress_parser.add_argument("src")
+  recompress_parser.add_argument("dst")
+  recompress_parser.add_argument("-l", "--level", type=int, default=9, choices=range(-1, 10), metavar="LEVEL",
+                                 help="zlib compression level, 0-9 or -1 for zlib's default (default: 9)")
+  recompress_parser.add_argument("--chunk-size", type=positive_int, default=32000, help="bytes per IDAT chunk")
+  recompress_parser.add_argument("-j", "--workers", type=int, default=None, help="compression threads (default: all cores)")
+  recompress_parser.add_argument("--block-size", type=positive_int, default=128, help="KiB of image data deflated per block")
+  recompress_parser.set_defaults(func=recompress)
+
+  args = parser.parse_args(argv)
+  return args.func(args)
+
+
+if __name__ == "__main__":
+  sys.exit(main())
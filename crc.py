@@ -0,0 +1,101 @@
+import functools
+import os
+import zlib
+
+
+BLOCK_SIZE = 8 << 20
+
+
+def gf2_matrix_times(mat, vec):
+  total = 0
+  i = 0
+  while vec:
+    if vec & 1:
+      total ^= mat[i]
+    vec >>= 1
+    i += 1
+  return total
+
+
+def gf2_matrix_square(mat):
+  return [gf2_matrix_times(mat, mat[n]) for n in range(32)]
+
+
+@functools.lru_cache(maxsize=32)
+def zeros_operator(length):
+  # GF(2) matrix that advances a CRC-32 over length zero bytes
+  op = [0xedb88320] + [1 << n for n in range(31)]
+  for _ in range(3):
+    op = gf2_matrix_square(op)
+  result = [1 << n for n in range(32)]
+  while length:
+    if length & 1:
+      result = [gf2_matrix_times(op, vec) for vec in result]
+    length >>= 1
+    if length:
+      op = gf2_matrix_square(op)
+  return result
+
+
+def crc32_combine(crc1, crc2, len2):
+  """CRC-32 of a + b given crc32(a), crc32(b) and len(b), as in zlib."""
+  return gf2_matrix_times(zeros_operator(len2), crc1) ^ crc2
+
+
+ADLER_BASE = 65521
+
+
+def adler32_combine(adler1, adler2, len2):
+  """Adler-32 of a + b given adler32(a), adler32(b) and len(b), as in zlib."""
+  rem = len2 % ADLER_BASE
+  sum1 = adler1 & 0xffff
+  sum2 = rem * sum1 % ADLER_BASE
+  sum1 = (sum1 + (adler2 & 0xffff) + ADLER_BASE - 1) % ADLER_BASE
+  sum2 = (sum2 + (adler1 >> 16) + (adler2 >> 16) + ADLER_BASE - rem) % ADLER_BASE
+  return sum1 | (sum2 << 16)
+
+
+def verify_crcs(data, chunks, threads=None, block_size=BLOCK_SIZE):
+  """Returns the chunks whose stored CRC does not match their type and data.
+
+  Payloads larger than block_size are split into blocks that are checked on
+  a thread pool (zlib.crc32 releases the GIL) and combined afterwards,
+  smaller chunks are checked inline. threads=1 keeps everything serial.
+  """
+  view = memoryview(data)
+  threads = threads or os.cpu_count() or 1
+  corrupt = []
+  pending = []
+  # only files with large chunks need the pool, the others don't pay for importing it
+  executor = None
+  try:
+    for chunk in chunks:
+      # the CRC covers the chunk type and data, which are contiguous
+      start = chunk.start + 4
+      end = chunk.start + 8 + chunk.datasize
+      stored = view[end:end+4]
+      if len(stored) < 4:
+        corrupt.append(chunk)
+        continue
+      stored = int.from_bytes(stored, byteorder="big", signed=False)
+      if threads == 1 or end - start <= block_size:
+        if zlib.crc32(view[start:end]) != stored:
+          corrupt.append(chunk)
+        continue
+      blocks = [view[i:min(i+block_size, end)] for i in range(start, end, block_size)]
+      if executor is None:
+        from concurrent.futures import ThreadPoolExecutor
+        executor = ThreadPoolExecutor(max_workers=threads)
+      pending.append((chunk, stored, blocks, executor.map(zlib.crc32, blocks)))
+
+    for chunk, stored, blocks, crcs in pending:
+      crc = 0
+      for block, block_crc in zip(blocks, crcs):
+        crc = crc32_combine(crc, block_crc, len(block))
+      if crc != stored:
+        corrupt.append(chunk)
+  finally:
+    if executor is not None:
+      executor.shutdown()
+  corrupt.sort(key=lambda chunk: chunk.start)
+  return corrupt
@@ -0,0 +1,165 @@
+import numpy as np
+
+from idat import ByteStream
+from parsers import parse_IHDR, parse_PLTE
+
+
+CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+BATCH_BYTES = 16 << 20
+
+# (x offset, y offset, x step, y step) of the seven Adam7 passes
+ADAM7 = ((0, 0, 8, 8), (4, 0, 8, 8), (0, 4, 4, 8), (2, 0, 4, 4), (0, 2, 2, 4), (1, 0, 2, 2), (0, 1, 1, 2))
+
+
+def unfilter_wavefront(filtered, prior, filter_types, bpp):
+  """Reverses the filters of a block of consecutive rows.
+
+  A byte depends at most on its left, upper and upper-left neighbours, so
+  every anti-diagonal of the block only needs the two before it. Walking
+  the block diagonal by diagonal decodes all of its rows together in
+  rows + width - 1 vectorized steps instead of one step per pixel, which
+  is what the Average and Paeth filters would otherwise need.
+  """
+  rows = filtered.shape[0]
+  width = filtered.shape[1] // bpp
+  raw = filtered.reshape(rows, width, bpp).astype(np.int16)
+  # one row of padding on top for the prior row, one column on the left for zeros
+  out = np.zeros((rows + 1, width + 1, bpp), dtype=np.int16)
+  out[0, 1:] = prior.reshape(width, bpp)
+  filter_types = filter_types[:, None]
+  for step in range(rows + width - 1):
+    y = np.arange(max(0, step - width + 1), min(rows, step + 1))
+    x = step - y
+    a = out[y + 1, x]
+    b = out[y, x + 1]
+    c = out[y, x]
+    p = a + b - c
+    pa = np.abs(p - a)
+    pb = np.abs(p - b)
+    pc = np.abs(p - c)
+    paeth = np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, c))
+    f = filter_types[y]
+    predictor = np.where(f == 4, paeth, np.where(f == 3, (a + b) >> 1, np.where(f == 2, b, np.where(f == 1, a, 0))))
+    out[y + 1, x + 1] = (raw[y, x] + predictor) & 0xFF
+  return out[1:, 1:].reshape(rows, width * bpp).astype(np.uint8)
+
+
+def unfilter(raw, height, row_bytes, bpp, prior=None):
+  lines = np.frombuffer(raw, dtype=np.uint8, count=height * (row_bytes + 1)).reshape(height, row_bytes + 1)
+  filter_types = lines[:, 0]
+  filtered = lines[:, 1:]
+  if filter_types.max(initial=0) > 4:
+    raise ValueError("Unknown scanline filter type.")
+  out = np.empty((height, row_bytes), dtype=np.uint8)
+  prev = prior if prior is not None else np.zeros(row_bytes, dtype=np.uint8)
+  # rows from the first to the last Average/Paeth row go through one wavefront,
+  # the rows around them only need vectorized Sub/Up
+  slow_rows = np.flatnonzero(filter_types >= 3)
+  first, last = (slow_rows[0], slow_rows[-1] + 1) if len(slow_rows) else (height, height)
+  y = 0
+  while y < height:
+    if y == first:
+      out[first:last] = unfilter_wavefront(filtered[first:last], prev, filter_types[first:last], bpp)
+      y = last
+    else:
+      filter_type = filter_types[y]
+      row = filtered[y]
+      if filter_type == 0:
+        out[y] = row
+      elif filter_type == 1:
+        out[y] = np.cumsum(row.reshape(-1, bpp), axis=0, dtype=np.uint8).reshape(-1)
+      else:
+        out[y] = row + prev
+      y += 1
+    prev = out[y - 1]
+  return out
+
+
+def to_samples(rows, width, channels, bit_depth):
+  height = rows.shape[0]
+  if bit_depth == 8:
+    return rows.reshape(height, width, channels)
+  if bit_depth == 16:
+    return rows.view(">u2").astype(np.uint16).reshape(height, width, channels)
+  # 1, 2 and 4 bit samples are only used by single channel color types
+  bits = np.unpackbits(rows, axis=1)[:, :width * bit_depth].reshape(height, width, bit_depth)
+  weights = (1 << np.arange(bit_depth - 1, -1, -1)).astype(np.uint8)
+  return (bits * weights).sum(axis=2, dtype=np.uint8).reshape(height, width, 1)
+
+
+def decode_pass(stream, width, height, ihdr, batch_bytes):
+  channels = CHANNELS[ihdr["color_type"]]
+  bits_per_pixel = channels * ihdr["bit_depth"]
+  row_bytes = (width * bits_per_pixel + 7) // 8
+  bpp = max(1, bits_per_pixel // 8)
+  dtype = np.uint16 if ihdr["bit_depth"] == 16 else np.uint8
+  samples = np.empty((height, width, channels), dtype=dtype)
+  # every batch restarts the wavefront, so keep batches at least as tall as the row is wide
+  batch_rows = max(batch_bytes // (row_bytes + 1), row_bytes // bpp, 1)
+  prior = None
+  for y in range(0, height, batch_rows):
+    rows_in_batch = min(batch_rows, height - y)
+    raw = stream.take(rows_in_batch * (row_bytes + 1))
+    rows = unfilter(raw, rows_in_batch, row_bytes, bpp, prior)
+    prior = rows[-1]
+    samples[y:y+rows_in_batch] = to_samples(rows, width, channels, ihdr["bit_depth"])
+  return samples
+
+
+def decode_samples(stream, ihdr, batch_bytes):
+  width = ihdr["width"]
+  height = ihdr["height"]
+  if ihdr["interlace_method"] == 0:
+    return decode_pass(stream, width, height, ihdr, batch_bytes)
+  dtype = np.uint16 if ihdr["bit_depth"] == 16 else np.uint8
+  samples = np.empty((height, width, CHANNELS[ihdr["color_type"]]), dtype=dtype)
+  for x0, y0, dx, dy in ADAM7:
+    pass_width = (width - x0 + dx - 1) // dx
+    pass_height = (height - y0 + dy - 1) // dy
+    if pass_width <= 0 or pass_height <= 0:
+      continue
+    samples[y0::dy, x0::dx] = decode_pass(stream, pass_width, pass_height, ihdr, batch_bytes)
+  return samples
+
+
+def apply_palette(img, indices):
+  chunk = img.get_chunk_by_name("PLTE")
+  palette = np.array(parse_PLTE(img.get_chunk_data(chunk.start, chunk.datasize)), dtype=np.uint8)
+  trns = img.get_chunk_by_name("tRNS")
+  if trns is not None:
+    alpha = np.full((len(palette), 1), 255, dtype=np.uint8)
+    trns_data = np.frombuffer(img.get_chunk_data(trns.start, trns.datasize), dtype=np.uint8)[:len(palette)]
+    alpha[:len(trns_data), 0] = trns_data
+    palette = np.hstack((palette, alpha))
+  return np.take(palette, indices[:, :, 0], axis=0, mode="clip")
+
+
+def decode_image(img, as_uint8=False, batch_bytes=BATCH_BYTES):
+  """Decodes the pixels of a PNG_Image into an ndarray.
+
+  Grayscale images come back as (height, width) arrays, the other color
+  types as (height, width, channels) with palette images expanded to RGB
+  (RGBA when they have a tRNS chunk). Samples keep their bit depth unless
+  as_uint8 is set, which scales them to 0-255 for display.
+
+  The IDAT payloads are inflated incrementally and unfiltered in batches
+  of about batch_bytes of scanlines, the compressed stream is never
+  joined into one buffer.
+  """
+  chunk = img.get_chunk_by_name("IHDR")
+  ihdr = parse_IHDR(img.get_chunk_data(chunk.start, chunk.datasize))
+  stream = ByteStream(img.iter_inflated())
+  samples = decode_samples(stream, ihdr, batch_bytes)
+
+  color_type = ihdr["color_type"]
+  bit_depth = ihdr["bit_depth"]
+  if color_type == 3:
+    return apply_palette(img, samples)
+  if as_uint8 and bit_depth == 16:
+    samples = (samples >> 8).astype(np.uint8)
+  elif as_uint8 and bit_depth < 8:
+    samples = samples * np.uint8(255 // ((1 << bit_depth) - 1))
+  if color_type == 0:
+    return samples[:, :, 0]
+  return samples
@@ -0,0 +1,85 @@
+import hashlib
+import mmap
+import os
+
+from index_cache import StatIndex
+from reader import iter_chunks
+
+
+DEFAULT_DEDUP_PATH = os.path.join(os.path.expanduser("~"), ".png_inspector", "dedup.sqlite")
+
+# chunks that make up the image itself, ancillary chunks don't change the digest
+CONTENT_CHUNKS = ("IHDR", "PLTE", "IDAT")
+
+
+def content_hash(data, chunks):
+  """Hex BLAKE2b digest of the IHDR, PLTE and IDAT payloads of a png.
+
+  chunks is its chunk index, only the payloads are read from data. Files
+  that differ only in ancillary chunks, or in how the image data is split
+  into IDAT chunks, get the same digest.
+  """
+  view = memoryview(data)
+  digest = hashlib.blake2b(digest_size=16)
+  in_idat = False
+  for chunk in chunks:
+    if chunk.name not in CONTENT_CHUNKS:
+      continue
+    start = chunk.start + 8
+    if chunk.name != "IDAT":
+      # the size and type go in with the payload, so IHDR and PLTE can't run together
+      digest.update(view[chunk.start:start])
+    elif not in_idat:
+      # the IDAT payloads are one stream, hashed without their chunk headers
+      digest.update(b"IDAT")
+      in_idat = True
+    digest.update(view[start:start+chunk.datasize])
+  return digest.hexdigest()
+
+
+def hash_file(filepath, chunks=None):
+  """Returns content_hash() of a png file, indexing it when chunks is None."""
+  with open(filepath, "rb") as f:
+    if chunks is None:
+      chunks = [chunk for chunk, _ in iter_chunks(f, names=())]
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+      return content_hash(data, chunks)
+
+
+def group_paths(digests):
+  """Groups paths by digest, digests maps path to digest.
+
+  Returns lists of paths, largest group first, each sorted by path.
+  """
+  groups = {}
+  for path, digest in digests.items():
+    groups.setdefault(digest, []).append(path)
+  return sorted((sorted(paths) for paths in groups.values()), key=lambda paths: (-len(paths), paths[0]))
+
+
+class DedupIndex(StatIndex):
+  """Persistent content digests of png files, stored in SQLite.
+
+  A repeat scan only hashes new and modified files. The digest column is
+  indexed, paths_with() finds every known file with the same content, also
+  in folders scanned earlier.
+  """
+  table = "content_digest"
+  columns = (("digest", "TEXT NOT NULL"),)
+  indexed = ("digest",)
+
+  def __init__(self, db_path=DEFAULT_DEDUP_PATH, max_entries=1000000, batch_size=1):
+    super().__init__(db_path, max_entries, batch_size)
+
+  def get(self, filepath, st=None):
+    values = self.get_values(filepath, st)
+    return values[0] if values is not None else None
+
+  def put(self, filepath, digest, st=None):
+    self.put_values(filepath, (digest,), st)
+
+  def paths_with(self, digest):
+    with self.lock:
+      rows = self.db.execute(
+        f"SELECT path FROM {self.table} WHERE digest = ? ORDER BY path", (digest,)).fetchall()
+    return [row[0] for row in rows]
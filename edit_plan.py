@@ -0,0 +1,61 @@
+from chunk import chunk_bytes
+
+
+class EditPlan:
+  """Queues chunk deletions, insertions and replacements against the chunk
+  index of a PNG_Image and applies them all in a single pass over its data.
+
+  Indices refer to img.chunks as it was when the plan was made. Insertions
+  go before the chunk at the given index, index len(img.chunks) appends.
+  """
+  def __init__(self, img):
+    self.img = img
+    self.deleted = set()
+    self.replaced = {}
+    self.inserted = {}
+
+  def position(self, index):
+    count = len(self.img.chunks)
+    if index < 0:
+      index += count
+    if not 0 <= index <= count:
+      raise IndexError(f"chunk index {index} out of range")
+    return index
+
+  def delete(self, index):
+    self.deleted.add(self.position(index))
+    return self
+
+  def replace(self, index, data):
+    self.replaced[self.position(index)] = data
+    return self
+
+  def insert(self, index, name, data):
+    self.inserted.setdefault(self.position(index), []).append((name, data))
+    return self
+
+  def is_empty(self):
+    return not (self.deleted or self.replaced or self.inserted)
+
+  def write_inserted(self, out, index):
+    for name, data in self.inserted.get(index, []):
+      out += chunk_bytes(name, data)
+
+  def apply(self):
+    img = self.img
+    out = bytearray(img.data[0:8])
+    for i, chunk in enumerate(img.chunks):
+      self.write_inserted(out, i)
+      if i in self.deleted:
+        continue
+      if i in self.replaced:
+        out += chunk_bytes(chunk.name, self.replaced[i])
+      else:
+        out += img.data[chunk.start:chunk.start+8+chunk.datasize+4]
+    self.write_inserted(out, len(img.chunks))
+    img.data = out
+    img.close()
+    img.index_chunks()
+    self.deleted.clear()
+    self.replaced.clear()
+    self.inserted.clear()
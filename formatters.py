@@ -0,0 +1,153 @@
+import lookup_tables as lt
+
+# text formatters of decoded chunks, keyed by chunk type, see format_chunk()
+FORMATTERS = {}
+
+
+def formatter(name):
+  def register(func):
+    FORMATTERS[name] = func
+    return func
+  return register
+
+
+def format_chunk(chunk, record):
+  """Console text of a chunk and its record, the Chunk fields when there's no formatter."""
+  format_record = FORMATTERS.get(chunk.name)
+  if format_record is None or record is None:
+    return str(chunk)
+  return format_record(chunk, record)
+
+
+@formatter("IHDR")
+def format_IHDR(chunk, ihdr):
+  text = '{0:16}{1:<}\n'.format("chunk name:", chunk.name)
+  text += '{0:16}{1:<}\n'.format("width [px]:", ihdr.width)
+  text += '{0:16}{1:<}\n'.format("height [px]:", ihdr.height)
+  text += '{0:16}{1:<}\n'.format("bit_depth:", ihdr.bit_depth)
+  text += '{0:16}{1:<8}{2}\n'.format("color_type:", ihdr.color_type, lt.ihdr_color_type.get(ihdr.color_type, "Unknown"))
+  return text
+
+
+@formatter("PLTE")
+def format_PLTE(chunk, plte):
+  text = '{0:16}{1}\n'.format("chunk name:", chunk.name)
+  text += '{0:8} | {1:>3} {2:>3} {3:>3}\n'.format("color:", "R", "G", "B")
+  text += '{0}\n'.format("--------------------")
+  for i, color in enumerate(plte.colors):
+    text += '{0:<8} | {1:3} {2:3} {3:3}\n'.format(i, color[0], color[1], color[2])
+  return text
+
+
+@formatter("iCCP")
+def format_iCCP(chunk, iccp):
+  profile = iccp.profile()
+  acsp = profile.signature
+  text = '{0:16}{1:<}\n'.format("chunk name:", chunk.name)
+  text += '{0:16}{1:<}\n'.format("profile name:", iccp.profile_name)
+  text += '{0:16}{1:<}\n'.format("profile size:", profile.profile_size)
+  text += '{0:16}{1:<}\n'.format("CMM type:", profile.cmm_type)
+  text += '{0:16}{1:}\n'.format("version:", profile.version)
+  text += '{0:16}{1:<12}{2}\n'.format("device class:", profile.device_class,
+                                      lt.iccp_device_class.get(profile.device_class, "Unknown"))
+  text += '{0:16}{1:<}\n'.format("color space:", profile.color_space)
+  text += '{0:16}{1:<}\n'.format("connect space:", profile.connection_space)
+  text += '{0:16}{1:<}\n'.format("date:", profile.date)
+  text += '{0:16}{1:<}\n'.format("time:", profile.time)
+  text += '{0:16}{1:<12}{2}\n'.format("signature:", acsp, "Correct" if acsp == 'acsp' else "Incorrect")
+  text += '{0:16}{1:<12}{2}\n'.format("platform:", profile.platform, lt.iccp_platform.get(profile.platform, "Unknown"))
+  text += '{0:16}{1:<}\n'.format("manufacturer:", profile.manufacturer)
+  text += '{0:16}{1:<}\n'.format("device model:", profile.device_model)
+  return text
+
+
+@formatter("tRNS")
+def format_tRNS(chunk, trns):
+  text = '{0:16}{1:<}\n\n'.format("chunk name:", chunk.name)
+  if trns.color_type == 0:
+    text += '{0:16}{1:<}\n'.format("alpha:", trns.alpha)
+  elif trns.color_type == 2:
+    text += '{0:16}{1:3} {2:3} {3:3}\n'.format("alpha:", *trns.alpha)
+  else:
+    text += '{0:8} | {1:<}\n'.format("index:", "alpha [0-255]")
+    text += '{0}\n'.format("--------------------")
+    for index, alpha in enumerate(trns.alpha):
+      text += '{0:<8} | {1:<}\n'.format(index, alpha)
+  return text
+
+
+@formatter("tEXt")
+def format_tEXt(chunk, text_chunk):
+  text = '{0:24}{1:<}\n'.format("chunk name:", chunk.name)
+  text += '{0:24}{1:<}\n'.format("keyword:", text_chunk.keyword)
+  for line in text_chunk.text.split("\n"):
+    text += '{0:24}{1:<}\n'.format("", line)
+  return text
+
+
+@formatter("zTXt")
+def format_zTXt(chunk, ztxt):
+  text = '{0:24}{1:<}\n'.format("chunk name:", chunk.name)
+  text += '{0:24}{1:<}\n'.format("keyword:", ztxt.keyword)
+  text += '{0:24}{1:<}\n'.format("compression method:", ztxt.compression_method)
+  for line in ztxt.text().split("\n"):
+    text += '{0:24}{1:<}\n'.format("", line)
+  return text
+
+
+@formatter("iTXt")
+def format_iTXt(chunk, itxt):
+  text = '{0:24}{1:<}\n'.format("chunk name:", chunk.name)
+  text += '{0:24}{1:<}\n'.format("keyword:", itxt.keyword)
+  text += '{0:24}{1:<}\n'.format("compression flag:", itxt.compression_flag)
+  text += '{0:24}{1:<}\n'.format("compression method:", itxt.compression_method)
+  text += '{0:24}{1:<}\n'.format("language tag:", itxt.language_tag)
+  text += '{0:24}{1:<}\n'.format("translated keyword:", itxt.translated_keyword)
+  for line in itxt.text().split("\n"):
+    text += '{0:24}{1:<}\n'.format("", line)
+  return text
+
+
+@formatter("gAMA")
+def format_gAMA(chunk, gama):
+  text = '{0:16}{1:<}\n'.format("chunk name:", chunk.name)
+  text += '{0:16}{1:<}\n'.format("gamma:", gama.gamma)
+  return text
+
+
+@formatter("pHYs")
+def format_pHYs(chunk, phys):
+  unit = "meter" if phys.unit == 1 else "unknown"
+  text = '{0:16}{1:<}\n'.format("chunk name:", chunk.name)
+  text += '{0:16}{1:<}\n'.format("x per unit:", phys.x_per_unit)
+  text += '{0:16}{1:<}\n'.format("y per unit:", phys.y_per_unit)
+  text += '{0:16}{1:<}\n'.format("unit:", unit)
+  return text
+
+
+@formatter("tIME")
+def format_tIME(chunk, time):
+  text = '{0:16}{1:<}\n'.format("chunk name:", chunk.name)
+  text += '{0:16}{1:02}-{2:02}-{3}\n'.format("date:", time.day, time.month, time.year)
+  text += '{0:16}{1:02}:{2:02}:{3:02}\n'.format("time:", time.hour, time.minute, time.second)
+  return text
+
+
+@formatter("sRGB")
+def format_sRGB(chunk, srgb):
+  intents = ("Perceptual", "Relative colorimetric", "Saturation", "Absolute colorimetric")
+  intent = intents[srgb.rendering_intent] if srgb.rendering_intent < len(intents) else "Unknown"
+  text = '{0:16}{1:<}\n'.format("chunk name:", chunk.name)
+  text += '{0:16}{1:<8}{2}\n'.format("intent:", srgb.rendering_intent, intent)
+  return text
+
+
+@formatter("eXIf")
+def format_eXIf(chunk, exif):
+  text = '{0:16}{1:<}\n'.format("chunk name:", chunk.name)
+  text += '{0:16}{1:<}\n'.format("byte order:", exif.byte_order)
+  text += '{0:8} {1:>6} {2:>10} {3:>10}\n'.format("tag:", "type", "count", "value")
+  text += '{0}\n'.format("--------------------------------------")
+  for tag, field_type, count, value in exif.tags:
+    text += '{0:<#8x} {1:>6} {2:>10} {3:>10}\n'.format(tag, field_type, count, value)
+  return text
@@ -1,17 +1,22 @@
-import io
 import os
 import PySimpleGUI as sg
-from PIL import Image, ImageTk
-import numpy as np
-import matplotlib as plt
-import matplotlib.pyplot as pyplt
-import cv2
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+import instrument
+from hexview import RawView
+from spectrum import SpectrumEngine
+from thumbnails import ThumbnailCache
+
+# rows of the file list on screen
+VISIBLE_FILES = 40
 
 class GUI:
   def __init__(self):
       self.window = None
       self.fig_agg = None
+      self.spectra = SpectrumEngine()
+      self.thumbnails = ThumbnailCache()
+      self.file_paths = []
+      self.raw_view = None
 
   def set_theme(self, theme='DefaultNoMoreNagging'):
       sg.theme(theme)
@@ -28,7 +33,7 @@ class GUI:
               sg.FolderBrowse(button_color=("black", "orange")),
           ],
           [
-              sg.Listbox(values=[], enable_events=True, size=(30,40), key="-FILE LIST-")
+              sg.Listbox(values=[], enable_events=True, size=(30,VISIBLE_FILES), key="-FILE LIST-")
           ]
       ]
 
@@ -79,7 +84,12 @@ class GUI:
               sg.Text("Raw data", font=("Helvetica", title_font_size)),
           ],
           [
-              sg.MLine(key='-RAW-'+sg.WRITE_ONLY_KEY, font=("Menlo"), size=(60,25)),
+              sg.MLine(key='-RAW-'+sg.WRITE_ONLY_KEY, font=("Menlo"), size=(72,25)),
+          ],
+          [
+              sg.Button("<", enable_events=True, disabled=True, key="-RAW PREV-", button_color=("black", "orange")),
+              sg.Button(">", enable_events=True, disabled=True, key="-RAW NEXT-", button_color=("black", "orange")),
+              sg.Text("", size=(40, 1), key="-RAW PAGE-"),
           ]
       ]
 
@@ -124,6 +134,14 @@ class GUI:
       and f.lower().endswith((".png"))
     ]
     self.window["-FILE LIST-"].update(fnames)
+    self.file_paths = [os.path.join(folder, f) for f in fnames]
+    self.prefetch_thumbnails()
+
+  def prefetch_thumbnails(self, filepath=None, radius=VISIBLE_FILES):
+    # the selected file first, then its neighbours outwards in both directions
+    index = self.file_paths.index(filepath) if filepath in self.file_paths else 0
+    order = [index] + [i for step in range(1, radius + 1) for i in (index + step, index - step)]
+    self.thumbnails.prefetch([self.file_paths[i] for i in order if 0 <= i < len(self.file_paths)])
 
   def fill_chunk_list(self, img):
     chunk_names = []
@@ -135,24 +153,40 @@ class GUI:
     img.print_chunk_named(name)
 
   def print_raw_output(self, name, img):
-    for chunk in img.chunks:
-      if chunk.name == name:
-        data = img.data[chunk.start:chunk.start + 8 + chunk.datasize + 4]
-        self.window['-RAW-'+sg.WRITE_ONLY_KEY].print(pretty(data, 20), "\n\n")
-
-  def display_image(self, filepath):
+    spans = [(chunk.start, chunk.start + 8 + chunk.datasize + 4) for chunk in img.get_chunks_named(name)]
+    self.raw_view = RawView(img.data, spans)
+    self.show_raw_page()
+
+  def turn_raw_page(self, step):
+    if self.raw_view is not None:
+      self.raw_view.turn(step)
+      self.show_raw_page()
+
+  def show_raw_page(self):
+    # only the current page is formatted and handed to the widget
+    view = self.raw_view
+    self.window['-RAW-'+sg.WRITE_ONLY_KEY].update(view.render() if view else "")
+    self.window["-RAW PAGE-"].update(view.describe() if view else "")
+    self.window["-RAW PREV-"].update(disabled=not view or view.page == 0)
+    self.window["-RAW NEXT-"].update(disabled=not view or view.page >= len(view.pages) - 1)
+
+  def display_image_data(self, data):
     try:
-      self.window["-IMAGE-"].update(data=self.get_img_data(filepath))
+      self.window["-IMAGE-"].update(data=data)
     except:
       pass
 
-  def display_spectrum(self, filepath, values):
+  def display_spectrum(self, pixels, values, key=None):
     if self.fig_agg is not None:
       self.delete_fig_agg(self.fig_agg)
-    fig = self.make_fig(filepath, values)
+    fig = self.make_fig(pixels, values, key=key)
     self.fig_agg = self.draw_figure(self.window["-FOURIER-"].TKCanvas, fig)
 
   def display_palette(self, colors):
+    # pyplot is only needed for the palette window, on the Tk backend like the spectrum
+    import matplotlib
+    matplotlib.use("TkAgg")
+    import matplotlib.pyplot as pyplt
     pyplt.ion()
     fig, ax = pyplt.subplots()
     for i in range(16):
@@ -168,37 +202,26 @@ class GUI:
     ax.get_xaxis().set_visible(False)
     ax.get_yaxis().set_visible(False)
 
-  def get_img_data(self, filename, resize=(500, 500)):
-    image = Image.open(filename)
-    width, height = image.size
-    if resize:
-      new_width, new_height = resize
-      scale = min(new_height/height, new_width/width)
-      image = image.resize((int(width*scale), int(height*scale)), Image.ANTIALIAS)
-    bio = io.BytesIO()
-    image.save(bio, format="PNG")
-    del image
-    return bio.getvalue()
-
   def draw_figure(self, canvas, figure):
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
     figure_canvas_agg = FigureCanvasTkAgg(figure, canvas)
     figure_canvas_agg.draw()
     figure_canvas_agg.get_tk_widget().pack(side="top", fill="both", expand=1)
     return figure_canvas_agg
 
-  def make_fig(self, filepath, values, resize=(500, 500)):
-    fig = plt.figure.Figure(figsize=(5, 4))
-    img = cv2.imread(filepath, 0)
-    width, height = (img.shape[1], img.shape[0])
-    new_width, new_height = resize
-    scale = min(new_height/height, new_width/width)
-    dimensions = (int(width*scale), int(height*scale))
-    resized_img = cv2.resize(img, dimensions)
-    fourier_img = np.fft.fftshift(np.fft.fft2(resized_img))
+  @instrument.timed("gui.make_fig")
+  def make_fig(self, pixels, values, resize=(500, 500), key=None):
+    # matplotlib is only imported once the first spectrum is drawn
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=(5, 4))
+    # key identifies the file, with it the transform is computed once per file and
+    # resolution and pixels are only needed when it isn't cached yet
+    spectrum = self.spectra.get(key, pixels, resize)
+    instrument.count(bytes=spectrum.half.nbytes)
     if values["-FFT-COMBO-"] == "Magnitude":
-      fig.figimage(20*np.log(np.abs(fourier_img)), cmap="gray", resize=True)
+      fig.figimage(spectrum.log_magnitude(), cmap="gray", resize=True)
     elif values["-FFT-COMBO-"] == "Phase":
-      fig.figimage(np.angle(fourier_img), cmap="gray", resize=True)
+      fig.figimage(spectrum.phase(), cmap="gray", resize=True)
     return fig
 
   def delete_fig_agg(self,fig_agg):
@@ -206,7 +229,9 @@ class GUI:
 
   def clear_consoles(self):
     self.window["-OUTPUT-"].update("")
-    self.window['-RAW-'+sg.WRITE_ONLY_KEY].update("")
+    # the view holds the image buffer, which edits replace
+    self.raw_view = None
+    self.show_raw_page()
   
   def set_buttons_state(self, chunk_name, filename):
     if filename:
@@ -219,15 +244,3 @@ class GUI:
       self.window["-DELETE CHUNK-"].update(disabled=False)
     else:
       self.window["-DELETE CHUNK-"].update(disabled=True)
-
-
-def pretty(bytes, linewidth):
-  i = 1
-  text = ""
-  for byte in bytes:
-    if i % linewidth == 0:
-      text += '{:02X}\n'.format(byte)
-    else:
-      text += '{:02X} '.format(byte)
-    i += 1
-  return text
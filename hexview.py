@@ -0,0 +1,46 @@
+LINE_WIDTH = 20
+
+PAGE_LINES = 256
+
+
+def hexdump(data, offset=0, linewidth=LINE_WIDTH):
+  """Hex dump of data, linewidth bytes a line, each line prefixed with its offset.
+
+  bytes.hex formats all the bytes in one call, the lines are then sliced
+  out of its output.
+  """
+  digits = bytes(data).hex(" ").upper()
+  step = 3 * linewidth
+  return "\n".join(f"{offset + i // 3:08X}  {digits[i:i+step-1]}" for i in range(0, len(digits), step))
+
+
+class RawView:
+  """Paged hex dump of spans of a buffer, such as all chunks of one type.
+
+  Only the current page is ever formatted, so a chunk of any size opens
+  as fast as a small one. Every span starts on a new page and the offset
+  column shows positions in the buffer.
+  """
+  def __init__(self, data, spans, page_lines=PAGE_LINES, linewidth=LINE_WIDTH):
+    self.data = data
+    self.linewidth = linewidth
+    self.page_bytes = page_lines * linewidth
+    self.pages = [(page_start, min(end, page_start + self.page_bytes))
+                  for start, end in spans
+                  for page_start in range(start, max(end, start + 1), self.page_bytes)]
+    self.page = 0
+
+  def turn(self, step):
+    self.page = min(max(self.page + step, 0), len(self.pages) - 1)
+
+  def render(self):
+    if not self.pages:
+      return ""
+    start, end = self.pages[self.page]
+    return hexdump(self.data[start:end], start, self.linewidth)
+
+  def describe(self):
+    if not self.pages:
+      return ""
+    start, end = self.pages[self.page]
+    return f"page {self.page + 1}/{len(self.pages)}, bytes {start:X}-{end:X}"
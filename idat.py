@@ -0,0 +1,199 @@
+import collections
+import os
+import zlib
+
+from crc import adler32_combine
+
+
+DEFLATE_BLOCK_SIZE = 128 << 10
+
+# deflate looks back at most this far, so a block only needs the tail of the one before
+WINDOW_SIZE = 32 << 10
+
+
+def iter_inflate(views, window=1 << 20):
+  """Yields the inflated IDAT stream in pieces of at most window bytes.
+
+  views are the IDAT payloads in file order, they are fed to a single
+  decompressobj at most window bytes at a time and never concatenated.
+  Raises zlib.error when the stream is corrupt or ends too early.
+  """
+  decompressor = zlib.decompressobj()
+  for view in views:
+    view = memoryview(view)
+    # bounded slices keep every unconsumed_tail copy small, whatever the payload size
+    for i in range(0, len(view), window):
+      data = view[i:i+window]
+      while data:
+        out = decompressor.decompress(data, window)
+        data = decompressor.unconsumed_tail
+        if out:
+          yield out
+  # drain output zlib still holds after the last input
+  while not decompressor.eof:
+    out = decompressor.decompress(b"", window)
+    if not out:
+      break
+    yield out
+  if not decompressor.eof:
+    raise zlib.error("Incomplete or truncated image data stream.")
+
+
+class Inflater:
+  """Inflates a zlib stream fed one piece at a time, keeping count of the
+  output instead of the output itself, to check an IDAT stream.
+  """
+  def __init__(self, window=1 << 20):
+    self.decompressor = zlib.decompressobj()
+    self.window = window
+    self.size = 0
+
+  def feed(self, data):
+    view = memoryview(data)
+    for i in range(0, len(view), self.window):
+      data = view[i:i+self.window]
+      while data:
+        self.size += len(self.decompressor.decompress(data, self.window))
+        data = self.decompressor.unconsumed_tail
+
+  def finish(self):
+    """Drains the stream and returns whether it ended properly."""
+    while not self.decompressor.eof:
+      out = self.decompressor.decompress(b"", self.window)
+      if not out:
+        break
+      self.size += len(out)
+    return self.decompressor.eof
+
+
+def iter_blocks(pieces, block_length):
+  """Regroups pieces into block_length blocks.
+
+  The last block is the remainder and is always yielded, empty when the
+  data divides evenly, matching len(data) // block_length + 1 blocks.
+  """
+  buffer = bytearray()
+  for piece in pieces:
+    buffer += piece
+    full = len(buffer) // block_length * block_length
+    for i in range(0, full, block_length):
+      yield bytes(buffer[i:i+block_length])
+    del buffer[:full]
+  yield bytes(buffer)
+
+
+def deflate_block(block, zdict, level, last):
+  # raw deflate, primed with the end of the previous block so matches can reach into it
+  if zdict:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=zdict)
+  else:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+  # a sync flush ends the block on a byte boundary without ending the stream
+  out = compressor.compress(block) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+  return out, zlib.adler32(block)
+
+
+def iter_deflate_jobs(pieces, block_size):
+  blocks = iter_blocks(pieces, block_size)
+  # iter_blocks always yields a last, possibly empty, block
+  block = next(blocks)
+  zdict = b""
+  for next_block in blocks:
+    yield block, zdict, False
+    zdict = block[-WINDOW_SIZE:]
+    block = next_block
+  yield block, zdict, True
+
+
+def iter_deflated_blocks(jobs, level, workers):
+  if workers == 1:
+    for block, zdict, last in jobs:
+      yield len(block), deflate_block(block, zdict, level, last)
+    return
+  from concurrent.futures import ThreadPoolExecutor
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    pending = collections.deque()
+    for block, zdict, last in jobs:
+      pending.append((len(block), executor.submit(deflate_block, block, zdict, level, last)))
+      if len(pending) >= 2 * workers:
+        size, future = pending.popleft()
+        yield size, future.result()
+    while pending:
+      size, future = pending.popleft()
+      yield size, future.result()
+
+
+def iter_deflate(pieces, level=zlib.Z_DEFAULT_COMPRESSION, block_size=DEFLATE_BLOCK_SIZE, workers=None):
+  """Yields a zlib stream of the concatenated pieces, deflated in parallel.
+
+  Like pigz, the data is cut into block_size blocks that are deflated
+  independently on a thread pool (zlib releases the GIL), each primed with
+  the last 32 KB of the block before it, and joined in order. The Adler-32
+  of the stream is combined from those of the blocks. At most two blocks
+  per worker are in flight, so pieces can be a stream. workers=1 deflates
+  inline.
+  """
+  if block_size <= 0:
+    raise ValueError("Block size must be positive.")
+  workers = workers or os.cpu_count() or 1
+  # the zlib header only depends on the level
+  yield zlib.compress(b"", level)[:2]
+  adler = 1
+  for size, (out, block_adler) in iter_deflated_blocks(iter_deflate_jobs(pieces, block_size), level, workers):
+    adler = adler32_combine(adler, block_adler, size)
+    yield out
+  yield adler.to_bytes(4, byteorder="big")
+
+
+class ByteStream:
+  def __init__(self, pieces):
+    self.pieces = iter(pieces)
+    self.buffer = bytearray()
+
+  def take(self, size):
+    while len(self.buffer) < size:
+      piece = next(self.pieces, None)
+      if piece is None:
+        raise ValueError("Image data ends too early.")
+      self.buffer += piece
+    data = bytes(self.buffer[:size])
+    del self.buffer[:size]
+    return data
+
+
+class IDATWriter:
+  """Compresses image data as it is written and hands out IDAT payloads.
+
+  emit is called with every chunk_size bytes of compressed output as soon
+  as they are available, and with the remainder on close(), which is
+  emitted even when empty. With compressed set, the data written already
+  is a zlib stream and is only split into payloads.
+  """
+  def __init__(self, emit, chunk_size=32000, level=zlib.Z_DEFAULT_COMPRESSION, compressed=False):
+    if chunk_size <= 0:
+      raise ValueError("IDAT chunk size must be positive.")
+    self.emit = emit
+    self.chunk_size = chunk_size
+    self.compressor = None if compressed else zlib.compressobj(level)
+    self.pending = bytearray()
+    self.written = 0
+    self.chunks = 0
+
+  def write(self, data):
+    self.written += len(data)
+    self.pending += self.compressor.compress(data) if self.compressor is not None else data
+    self.emit_full_chunks()
+
+  def emit_full_chunks(self):
+    while len(self.pending) >= self.chunk_size:
+      self.emit(bytes(self.pending[:self.chunk_size]))
+      self.chunks += 1
+      del self.pending[:self.chunk_size]
+
+  def close(self):
+    if self.compressor is not None:
+      self.pending += self.compressor.flush()
+    self.emit_full_chunks()
+    self.emit(bytes(self.pending))
+    self.chunks += 1
+    self.pending.clear()
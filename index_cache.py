@@ -0,0 +1,141 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from chunk import Chunk
+
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".png_inspector", "index.sqlite")
+
+
+class StatIndex:
+  """SQLite table of per-file entries, valid while the file's mtime and size
+  are unchanged, so a lookup costs one stat and one read.
+
+  Subclasses name the table and the columns stored besides the path, mtime,
+  size and last use. Hits only note their last use in memory, puts are
+  committed every batch_size writes together with those notes, and
+  flush() and close() commit the rest. Once the table holds more than
+  max_entries rows, the least recently used ones are evicted at commit
+  time. The connection is shared between threads behind a lock.
+  """
+  table = None
+  # (name, SQL type) of the stored values
+  columns = ()
+  # value columns that get an index of their own
+  indexed = ()
+
+  def __init__(self, db_path, max_entries, batch_size=1):
+    self.max_entries = max_entries
+    self.batch_size = batch_size
+    folder = os.path.dirname(db_path)
+    if folder:
+      os.makedirs(folder, exist_ok=True)
+    self.lock = threading.Lock()
+    self.db = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+    self.db.execute("PRAGMA journal_mode=WAL")
+    self.db.execute("PRAGMA synchronous=NORMAL")
+    value_columns = "".join(f"        {name} {kind},\n" for name, kind in self.columns)
+    self.db.execute(f"""
+      CREATE TABLE IF NOT EXISTS {self.table} (
+        path TEXT PRIMARY KEY,
+        mtime_ns INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+{value_columns}        last_used REAL NOT NULL
+      )""")
+    for name in self.indexed + ("last_used",):
+      self.db.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_{name} ON {self.table} ({name})")
+    self.db.commit()
+    # upper bound of the row count, replaced rows are counted again until the next eviction
+    self.entries = self.db.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+    self.touched = {}
+    self.dirty = 0
+
+  def get_values(self, filepath, st=None):
+    path = os.path.abspath(filepath)
+    try:
+      st = st or os.stat(path)
+    except OSError:
+      return None
+    names = ", ".join(name for name, _ in self.columns)
+    with self.lock:
+      row = self.db.execute(
+        f"SELECT mtime_ns, size, {names} FROM {self.table} WHERE path = ?", (path,)).fetchone()
+      if row is None or row[0] != st.st_mtime_ns or row[1] != st.st_size:
+        return None
+      self.touched[path] = time.time()
+    return row[2:]
+
+  def put_values(self, filepath, values, st=None):
+    path = os.path.abspath(filepath)
+    try:
+      st = st or os.stat(path)
+    except OSError:
+      return
+    placeholders = ", ".join("?" * (len(self.columns) + 4))
+    with self.lock:
+      self.db.execute(
+        f"INSERT OR REPLACE INTO {self.table} VALUES ({placeholders})",
+        (path, st.st_mtime_ns, st.st_size, *values, time.time()))
+      self.touched.pop(path, None)
+      self.entries += 1
+      self.dirty += 1
+      if self.dirty >= self.batch_size:
+        self.commit()
+
+  def commit(self):
+    # called with the lock held
+    if self.touched:
+      self.db.executemany(f"UPDATE {self.table} SET last_used = ? WHERE path = ?",
+                          [(last_used, path) for path, last_used in self.touched.items()])
+      self.touched.clear()
+    if self.entries > self.max_entries:
+      self.evict()
+    self.db.commit()
+    self.dirty = 0
+
+  def evict(self):
+    self.entries = self.db.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+    excess = self.entries - self.max_entries
+    if excess > 0:
+      # walks the last_used index from the old end, only as far as it deletes
+      self.db.execute(
+        f"DELETE FROM {self.table} WHERE path IN "
+        f"(SELECT path FROM {self.table} ORDER BY last_used LIMIT ?)", (excess,))
+      self.entries -= excess
+
+  def flush(self):
+    with self.lock:
+      self.commit()
+
+  def close(self):
+    with self.lock:
+      self.commit()
+      self.db.close()
+
+
+class IndexCache(StatIndex):
+  """Persistent chunk index of png files, stored in SQLite.
+
+  Entries hold the Chunk list and the parsed IHDR/PLTE/iCCP fields of a
+  file. The GUI loader uses it from its worker threads, scan --cache
+  commits once per batch of records.
+  """
+  table = "chunk_index"
+  columns = (("chunks", "TEXT NOT NULL"), ("fields", "TEXT NOT NULL"))
+
+  def __init__(self, db_path=DEFAULT_CACHE_PATH, max_entries=100000, batch_size=1):
+    super().__init__(db_path, max_entries, batch_size)
+
+  def get(self, filepath, st=None):
+    values = self.get_values(filepath, st)
+    if values is None:
+      return None
+    chunks = [Chunk(*entry) for entry in json.loads(values[0])]
+    return chunks, json.loads(values[1])
+
+  def put(self, filepath, chunks, fields, st=None):
+    encoded_chunks = json.dumps([(chunk.start, chunk.name, chunk.datasize, chunk.crc) for chunk in chunks])
+    self.put_values(filepath, (encoded_chunks, json.dumps(fields)), st)
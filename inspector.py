@@ -1,15 +1,18 @@
 import os.path
 
-import matplotlib as plt
 import PySimpleGUI as sg
 
-from image import PNG_Image
+import instrument
+from index_cache import IndexCache
 from gui import GUI
+from loader import ImageLoader, LOADED_CHUNKS, LOADED_PREVIEW, LOADED_SPECTRUM, LOAD_FAILED
 
 
-def run_main_gui_loop(gui):
-  plt.use("TkAgg")
+def run_main_gui_loop(gui, cache=None):
+  loader = ImageLoader(gui, cache)
+  generation = None
   img = None
+  spectrum_key = None
   chunk_name = None
 
   while True:
@@ -23,16 +26,31 @@ def run_main_gui_loop(gui):
         chunk_name = None
         filepath = os.path.join(values["-FOLDER-"], values["-FILE LIST-"][0])
         gui.clear_consoles()
-        gui.set_buttons_state(chunk_name, filepath)
-        img = PNG_Image(filepath)
-        img.set_raw_data()
-        img.is_signature_correct()
-        img.index_chunks()
-        gui.fill_chunk_list(img)
-        gui.display_image(filepath)
-        gui.display_spectrum(filepath, values)
+        # the previous image stays on screen but can't be edited until the new one is indexed
+        img = None
+        spectrum_key = None
+        gui.set_buttons_state(chunk_name, None)
+        # decoded once in the background, shared by the preview and the spectrum
+        generation = loader.load(filepath)
+        # arrow keys move to a neighbour next, have its thumbnail ready
+        gui.prefetch_thumbnails(filepath)
       except:
         continue
+    elif event in (LOADED_CHUNKS, LOADED_PREVIEW, LOADED_SPECTRUM, LOAD_FAILED):
+      event_generation, payload = values[event]
+      if event_generation != generation:
+        continue
+      if event == LOADED_CHUNKS:
+        img = payload
+        gui.fill_chunk_list(img)
+        gui.set_buttons_state(chunk_name, filepath)
+      elif event == LOADED_PREVIEW:
+        gui.display_image_data(payload)
+      elif event == LOADED_SPECTRUM:
+        spectrum_key = payload
+        gui.display_spectrum(None, values, spectrum_key)
+      else:
+        print("Could not load", filepath, "-", payload)
     elif event == "-CHUNK LIST-":
       try:
         chunk_name = values["-CHUNK LIST-"][0]
@@ -72,19 +90,27 @@ def run_main_gui_loop(gui):
         gui.set_buttons_state(chunk_name, filepath)
       # except:
       #   continue
+    elif event == "-RAW PREV-":
+      gui.turn_raw_page(-1)
+    elif event == "-RAW NEXT-":
+      gui.turn_raw_page(1)
     elif event == "-FFT-COMBO-":
       try:
-        filepath = os.path.join(values["-FOLDER-"], values["-FILE LIST-"][0])
-        gui.display_spectrum(filepath, values)
+        gui.display_spectrum(None, values, spectrum_key)
       except:
         continue
+  loader.close()
 
 def main():
+  instrument.enable_from_env()
   gui = GUI()
   gui.set_theme()
   gui.init_layout()
-  run_main_gui_loop(gui)
+  cache = IndexCache()
+  run_main_gui_loop(gui, cache)
   gui.window.close()
+  cache.close()
+  instrument.disable()
 
 if __name__== "__main__":
   main()
\ No newline at end of file
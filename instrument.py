@@ -0,0 +1,280 @@
+import contextlib
+import functools
+import io
+import math
+import os
+import threading
+import time
+
+
+# checked first by every span and counter, so disabled instrumentation
+# costs one global lookup per call
+enabled = False
+memory = False
+sinks = []
+
+local = threading.local()
+
+
+class Span:
+  __slots__ = ("name", "counters", "start", "wall_start")
+
+  def __init__(self, name):
+    self.name = name
+    self.counters = {}
+
+  def __enter__(self):
+    stack = getattr(local, "stack", None)
+    if stack is None:
+      stack = local.stack = []
+    stack.append(self)
+    if memory and len(stack) == 1:
+      import tracemalloc
+      tracemalloc.reset_peak()
+    self.wall_start = time.time()
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, exc_type, exc, tb):
+    duration = time.perf_counter() - self.start
+    stack = local.stack
+    stack.pop()
+    record = {
+      "name": self.name,
+      "start": self.wall_start,
+      "duration": duration,
+      "depth": len(stack),
+      "thread": threading.current_thread().name,
+    }
+    if exc_type is not None:
+      record["error"] = exc_type.__name__
+    if memory and not stack:
+      import tracemalloc
+      record["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+    record.update(self.counters)
+    for sink in sinks:
+      sink(record)
+    return False
+
+  def count(self, **counters):
+    for key, value in counters.items():
+      self.counters[key] = self.counters.get(key, 0) + value
+
+
+class NullSpan:
+  __slots__ = ()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc, tb):
+    return False
+
+  def count(self, **counters):
+    pass
+
+
+NULL_SPAN = NullSpan()
+
+
+def span(name):
+  """Context manager timing a block, a shared no-op while disabled."""
+  return Span(name) if enabled else NULL_SPAN
+
+
+def timed(name):
+  """Decorator running every call of a function in a span."""
+  def decorator(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+      if not enabled:
+        return func(*args, **kwargs)
+      with Span(name):
+        return func(*args, **kwargs)
+    return wrapper
+  return decorator
+
+
+def count(**counters):
+  """Adds to the counters (bytes, chunks, ...) of the innermost open span."""
+  if not enabled:
+    return
+  stack = getattr(local, "stack", None)
+  if stack:
+    stack[-1].count(**counters)
+
+
+def enable(*new_sinks, trace_memory=False):
+  """Turns instrumentation on and sends finished spans to the given sinks.
+
+  With trace_memory, tracemalloc runs while enabled and outermost spans
+  also report their peak traced memory. That slows allocation-heavy code
+  down noticeably, so it is meant for profiling sessions only.
+  """
+  global enabled, memory
+  import tracemalloc
+  sinks.extend(new_sinks)
+  memory = trace_memory
+  if memory and not tracemalloc.is_tracing():
+    tracemalloc.start()
+  enabled = True
+
+
+def disable():
+  global enabled, memory
+  import tracemalloc
+  enabled = False
+  if memory and tracemalloc.is_tracing():
+    tracemalloc.stop()
+  memory = False
+  for sink in sinks:
+    close = getattr(sink, "close", None)
+    if close is not None:
+      close()
+  sinks.clear()
+
+
+def enable_from_env(variable="PNG_INSPECTOR_TRACE"):
+  """Enables a JSON lines sink when the variable names an output file."""
+  path = os.environ.get(variable)
+  if path:
+    enable(JSONLinesSink(path))
+  return bool(path)
+
+
+class LogSink:
+  def __init__(self, logger=None, level=None):
+    import logging
+    self.logger = logger or logging.getLogger("png_inspector")
+    self.level = logging.DEBUG if level is None else level
+
+  def __call__(self, record):
+    if not self.logger.isEnabledFor(self.level):
+      return
+    counters = " ".join(f"{key}={value}" for key, value in record.items()
+                        if key not in ("name", "start", "duration", "depth", "thread"))
+    self.logger.log(self.level, "%s%s %.3f ms %s", "  " * record["depth"], record["name"],
+                    1000 * record["duration"], counters)
+
+
+class JSONLinesSink:
+  """Appends one JSON object per span to a file."""
+  def __init__(self, path):
+    import json
+    self.dumps = json.dumps
+    self.file = open(path, "a", buffering=1)
+    self.lock = threading.Lock()
+
+  def __call__(self, record):
+    line = self.dumps(record) + "\n"
+    with self.lock:
+      self.file.write(line)
+
+  def close(self):
+    self.file.close()
+
+
+class HistogramSink:
+  """Keeps per span name counts of durations in power of two microsecond buckets.
+
+  Memory stays constant however many spans are recorded. Percentiles are
+  read from the bucket bounds, so they are accurate to a factor of two.
+  """
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.buckets = {}
+    self.totals = {}
+    self.counters = {}
+
+  def __call__(self, record):
+    name = record["name"]
+    bucket = max(0, math.ceil(math.log2(max(record["duration"] * 1e6, 1))))
+    with self.lock:
+      buckets = self.buckets.setdefault(name, {})
+      buckets[bucket] = buckets.get(bucket, 0) + 1
+      self.totals[name] = self.totals.get(name, 0.0) + record["duration"]
+      counters = self.counters.setdefault(name, {})
+      for key, value in record.items():
+        if key not in ("start", "duration", "depth", "peak_bytes") and isinstance(value, (int, float)):
+          counters[key] = counters.get(key, 0) + value
+
+  def percentile(self, name, q):
+    buckets = sorted(self.buckets[name].items())
+    rank = q * sum(n for _, n in buckets)
+    seen = 0
+    for bucket, n in buckets:
+      seen += n
+      if seen >= rank:
+        return (1 << bucket) / 1e6
+    return (1 << buckets[-1][0]) / 1e6
+
+  def summary(self):
+    with self.lock:
+      return {
+        name: {
+          "count": sum(buckets.values()),
+          "total": self.totals[name],
+          "mean": self.totals[name] / sum(buckets.values()),
+          "p50": self.percentile(name, 0.5),
+          "p90": self.percentile(name, 0.9),
+          "p99": self.percentile(name, 0.99),
+          **self.counters[name],
+        }
+        for name, buckets in self.buckets.items()
+      }
+
+  def report(self):
+    lines = ["{:<24}{:>8}{:>12}{:>12}{:>12}{:>12}".format("span", "count", "total ms", "mean ms", "p50 ms", "p99 ms")]
+    for name, s in sorted(self.summary().items(), key=lambda item: -item[1]["total"]):
+      lines.append("{:<24}{:>8}{:>12.3f}{:>12.3f}{:>12.3f}{:>12.3f}".format(
+        name, s["count"], 1000*s["total"], 1000*s["mean"], 1000*s["p50"], 1000*s["p99"]))
+    return "\n".join(lines)
+
+
+class Capture:
+  """Result of capture(): profiler statistics and the top allocation sites."""
+  def __init__(self):
+    self.profile = None
+    self.snapshot = None
+
+  def stats(self, sort="cumulative", limit=25):
+    if self.profile is None:
+      return ""
+    import pstats
+    out = io.StringIO()
+    pstats.Stats(self.profile, stream=out).sort_stats(sort).print_stats(limit)
+    return out.getvalue()
+
+  def top_allocations(self, limit=25):
+    if self.snapshot is None:
+      return []
+    return self.snapshot.statistics("lineno")[:limit]
+
+
+@contextlib.contextmanager
+def capture(profile=True, allocations=False):
+  """Runs the block under cProfile and/or tracemalloc.
+
+    with instrument.capture() as result:
+      img.encrypt(public)
+    print(result.stats())
+  """
+  import cProfile
+  import tracemalloc
+  result = Capture()
+  profiler = cProfile.Profile() if profile else None
+  started_tracing = allocations and not tracemalloc.is_tracing()
+  if started_tracing:
+    tracemalloc.start()
+  if profiler is not None:
+    profiler.enable()
+  try:
+    yield result
+  finally:
+    if profiler is not None:
+      profiler.disable()
+      result.profile = profiler
+    if allocations:
+      result.snapshot = tracemalloc.take_snapshot()
+    if started_tracing:
+      tracemalloc.stop()
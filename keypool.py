@@ -0,0 +1,166 @@
+import collections
+import functools
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import myrsa
+
+
+class KeyStore:
+  """Passphrase-protected file holding ready RSA key pairs.
+
+  The content is XORed with a SHAKE-256 keystream and authenticated with
+  HMAC-SHA256, both keyed from the passphrase with PBKDF2. A fresh nonce
+  is drawn on every save.
+  """
+  def __init__(self, path, passphrase, iterations=200000):
+    self.path = path
+    self.lock = threading.Lock()
+    self.salt = None
+    if os.path.exists(path):
+      with open(path) as f:
+        self.salt = bytes.fromhex(json.load(f)["salt"])
+    self.salt = self.salt or secrets.token_bytes(16)
+    key = hashlib.pbkdf2_hmac("sha256", passphrase.encode("utf-8"), self.salt, iterations, dklen=64)
+    self.enc_key = key[:32]
+    self.mac_key = key[32:]
+
+  def keystream_xor(self, nonce, data):
+    stream = hashlib.shake_256(self.enc_key + nonce).digest(len(data))
+    return (int.from_bytes(data, "big") ^ int.from_bytes(stream, "big")).to_bytes(len(data), "big")
+
+  def load(self):
+    if not os.path.exists(self.path):
+      return {}
+    with self.lock, open(self.path) as f:
+      record = json.load(f)
+    nonce = bytes.fromhex(record["nonce"])
+    data = bytes.fromhex(record["data"])
+    mac = hmac.new(self.mac_key, self.salt + nonce + data, hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(mac, record["mac"]):
+      raise ValueError("Key store is corrupt or the passphrase is wrong.")
+    keys = json.loads(self.keystream_xor(nonce, data))
+    return {int(bits): [(tuple(public), tuple(private)) for public, private in pairs] for bits, pairs in keys.items()}
+
+  def save(self, keys):
+    nonce = secrets.token_bytes(16)
+    data = self.keystream_xor(nonce, json.dumps(keys).encode("utf-8"))
+    record = {
+      "salt": self.salt.hex(),
+      "nonce": nonce.hex(),
+      "data": data.hex(),
+      "mac": hmac.new(self.mac_key, self.salt + nonce + data, hashlib.sha256).hexdigest(),
+    }
+    with self.lock:
+      tmp_path = self.path + ".tmp"
+      with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+        json.dump(record, f)
+      os.replace(tmp_path, self.path)
+
+
+class KeyPool:
+  """Keeps RSA key pairs ready so encryption jobs don't wait for keygen.
+
+  sizes maps a key length in bits to the number of pairs kept ready.
+  Missing pairs are generated on a process pool in the background and
+  get() pops a ready pair in O(1), only blocking when the pool has run
+  dry, and raises the error of a keygen job that failed while it waited.
+  With store_path and passphrase the ready pairs are persisted in an
+  encrypted KeyStore and reused by the next run.
+
+    pool = KeyPool({1024: 8, 2048: 2})
+    public, private = pool.get(1024)
+    img.encrypt(public, bits=1024)
+  """
+  def __init__(self, sizes=None, workers=None, store_path=None, passphrase=None):
+    self.sizes = dict(sizes) if sizes is not None else {1024: 4}
+    self.closed = False
+    self.keys = {bits: collections.deque() for bits in self.sizes}
+    self.pending = {bits: 0 for bits in self.sizes}
+    # the last keygen failure per size, raised by a get() waiting on it
+    self.errors = {}
+    self.lock = threading.Condition(threading.RLock())
+    self.store = KeyStore(store_path, passphrase) if store_path else None
+    if self.store is not None:
+      for bits, pairs in self.store.load().items():
+        self.add_size(bits)
+        self.keys[bits].extend(pairs)
+    self.executor = ProcessPoolExecutor(max_workers=workers)
+    # persisting happens off the caller's thread so get() stays O(1)
+    self.saver = ThreadPoolExecutor(max_workers=1)
+    self.refill()
+
+  def add_size(self, bits):
+    if bits not in self.sizes:
+      self.sizes[bits] = 1
+      self.keys[bits] = collections.deque()
+      self.pending[bits] = 0
+
+  def refill(self):
+    with self.lock:
+      for bits, target in self.sizes.items():
+        for _ in range(target - len(self.keys[bits]) - self.pending[bits]):
+          self.pending[bits] += 1
+          future = self.executor.submit(myrsa.generate_keys, bits)
+          future.add_done_callback(functools.partial(self.key_ready, bits))
+
+  def key_ready(self, bits, future):
+    with self.lock:
+      self.pending[bits] -= 1
+      error = RuntimeError("Key pool was closed.") if future.cancelled() else future.exception()
+      if error is None:
+        self.errors.pop(bits, None)
+        self.keys[bits].append(future.result())
+      else:
+        if not future.cancelled():
+          print("Could not generate a", bits, "bit key -", error)
+        self.errors[bits] = error
+      self.lock.notify_all()
+    if error is None:
+      self.save_later()
+
+  def get(self, bits=1024, timeout=None):
+    with self.lock:
+      self.add_size(bits)
+      if not self.keys[bits]:
+        # an earlier failure nobody waited on doesn't stop a fresh attempt
+        self.errors.pop(bits, None)
+        self.refill()
+        if not self.lock.wait_for(lambda: self.keys[bits] or bits in self.errors, timeout):
+          raise TimeoutError(f"No {bits}-bit key became ready in time.")
+        if not self.keys[bits]:
+          raise self.errors.pop(bits)
+      key = self.keys[bits].popleft()
+    self.refill()
+    self.save_later()
+    return key
+
+  def ready(self, bits):
+    with self.lock:
+      return len(self.keys.get(bits, ()))
+
+  def save_later(self):
+    with self.lock:
+      if self.store is None or self.closed:
+        return
+      self.saver.submit(self.save)
+
+  def save(self):
+    if self.store is None:
+      return
+    with self.lock:
+      keys = {bits: list(pairs) for bits, pairs in self.keys.items()}
+    self.store.save(keys)
+
+  def close(self):
+    with self.lock:
+      self.closed = True
+    # waits for the keygen jobs already running, their keys go into the final save
+    self.executor.shutdown(wait=True, cancel_futures=True)
+    self.saver.shutdown()
+    self.save()
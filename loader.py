@@ -0,0 +1,91 @@
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from image import PNG_Image
+from spectrum import file_key
+
+
+LOADED_CHUNKS = "-LOADED CHUNKS-"
+LOADED_PREVIEW = "-LOADED PREVIEW-"
+LOADED_SPECTRUM = "-LOADED SPECTRUM-"
+LOAD_FAILED = "-LOAD FAILED-"
+
+
+class ImageLoader:
+  """Loads the selected png file on worker threads, off the event loop.
+
+  Every stage hands its result to the window with write_event_value as
+  soon as it is ready, so the chunk list shows up before the image is
+  decoded: LOADED_CHUNKS carries the indexed PNG_Image, LOADED_PREVIEW the
+  encoded preview, now cached in gui.thumbnails, LOADED_SPECTRUM the key
+  of the spectrum now cached in gui.spectra. The image is only decoded
+  when either is missing, once, and the pixels are shared by both. Event
+  values are (generation, payload) pairs.
+
+  load() starts a new generation. Jobs of older generations stop at the
+  next stage boundary and post nothing more, the event loop only has to
+  drop events that were already queued.
+  """
+  def __init__(self, gui, cache=None, workers=2):
+    self.gui = gui
+    self.cache = cache
+    self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="loader")
+    self.generations = itertools.count(1)
+    self.generation = 0
+    self.lock = threading.Lock()
+
+  def load(self, filepath, resize=(500, 500)):
+    with self.lock:
+      self.generation = next(self.generations)
+      generation = self.generation
+    self.executor.submit(self.run, generation, filepath, resize)
+    return generation
+
+  def is_current(self, generation):
+    return generation == self.generation
+
+  def post(self, generation, event, payload):
+    with self.lock:
+      if not self.is_current(generation):
+        return False
+      self.gui.window.write_event_value(event, (generation, payload))
+      return True
+
+  def run(self, generation, filepath, resize):
+    if not self.is_current(generation):
+      return
+    try:
+      img = PNG_Image(filepath, use_mmap=True, cache=self.cache)
+      if not self.post(generation, LOADED_CHUNKS, img):
+        img.close()
+        return
+      thumbnails = self.gui.thumbnails
+      thumbnail_key = thumbnails.key(filepath, resize)
+      preview = thumbnails.cached(thumbnail_key)
+      key = file_key(filepath)
+      spectrum = self.gui.spectra.lookup(key, resize)
+      if preview is None or spectrum is None:
+        from decoder import decode_image
+        # decoded once, from a private copy as the loop may edit and save img meanwhile
+        pixels = decode_image(PNG_Image(filepath, cache=self.cache), as_uint8=True)
+        if not self.is_current(generation):
+          return
+        if preview is None:
+          preview = thumbnails.store_pixels(thumbnail_key, pixels, resize)
+      if not self.post(generation, LOADED_PREVIEW, preview):
+        return
+      if spectrum is None:
+        spectrum = self.gui.spectra.get(key, pixels, resize)
+      # both views up front, switching between them never waits for the transform
+      spectrum.log_magnitude()
+      spectrum.phase()
+      self.post(generation, LOADED_SPECTRUM, key)
+    except Exception as e:
+      self.post(generation, LOAD_FAILED, e)
+
+  def close(self):
+    with self.lock:
+      self.generation = next(self.generations)
+    self.executor.shutdown(wait=False, cancel_futures=True)
+    self.gui.thumbnails.close()
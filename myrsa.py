@@ -1,10 +1,53 @@
+import bisect
+import math
 import secrets
 
 
-def is_prime(n, iterations=100):
-    for i in range(iterations):
+def small_primes(limit):
+    sieve = bytearray([1]) * limit
+    sieve[0:2] = b"\x00\x00"
+    for i in range(2, math.isqrt(limit) + 1):
+        if sieve[i]:
+            sieve[i*i::i] = bytes(len(range(i*i, limit, i)))
+    return [i for i in range(limit) if sieve[i]]
+
+SMALL_PRIMES = small_primes(2000)
+SMALL_PRIMES_PRODUCT = math.prod(SMALL_PRIMES)
+
+def miller_rabin_rounds(bits):
+    # error probability below 2^-80 for random candidates (HAC, table 4.4)
+    for min_bits, rounds in ((1300, 2), (850, 3), (650, 4), (550, 5), (450, 6), (400, 7),
+                             (350, 8), (300, 9), (250, 12), (200, 15), (150, 18)):
+        if bits >= min_bits:
+            return rounds
+    return 27
+
+def is_prime(n, rounds=None):
+    if n < 2:
+        return False
+    if n <= SMALL_PRIMES[-1]:
+        return n in SMALL_PRIMES
+    if math.gcd(n, SMALL_PRIMES_PRODUCT) != 1:
+        return False
+    return miller_rabin(n, rounds)
+
+def miller_rabin(n, rounds=None):
+    rounds = rounds or miller_rabin_rounds(n.bit_length())
+    d = n - 1
+    s = 0
+    while d % 2 == 0:
+        d //= 2
+        s += 1
+    for i in range(rounds):
         a = secrets.randbelow(n-4) + 2
-        if pow(a, n-1, n) != 1:
+        x = pow(a, d, n)
+        if x == 1 or x == n-1:
+            continue
+        for j in range(s-1):
+            x = pow(x, 2, n)
+            if x == n-1:
+                break
+        else:
             return False
     return True # probably
 
@@ -14,11 +57,36 @@ def random_number(bits):
         n = secrets.randbits(bits)
     return n
 
-def random_prime(bits):
-    n = random_number(bits)
-    while not is_prime(n):
-        n = random_number(bits)
-    return n
+def sieve_size(bits):
+    # primes are about bits*ln(2) apart, so a window of 4*bits odd numbers
+    # holds several of them; sieving small candidates by every prime below
+    # 2000 would cost more than the Miller-Rabin tests it saves
+    window = min(4096, 4 * bits)
+    primes = SMALL_PRIMES[1:bisect.bisect_left(SMALL_PRIMES, 4 * bits)]
+    return window, primes
+
+def random_prime(bits, e=None, window=None):
+    default_window, sieve_primes = sieve_size(bits)
+    window = window or default_window
+    while True:
+        # sieve the odd numbers base, base+2, ... base+2*(window-1) by the
+        # small primes, then run Miller-Rabin only on the survivors
+        base = random_number(bits) | 1
+        composite = bytearray(window)
+        for p in sieve_primes:
+            first = (-base * ((p+1) // 2)) % p
+            composite[first::p] = b"\x01" * len(range(first, window, p))
+        for i in range(window):
+            if composite[i]:
+                continue
+            n = base + 2*i
+            if n.bit_length() > bits:
+                break
+            if e is not None and math.gcd(e, n-1) != 1:
+                continue
+            # survivors go straight to Miller-Rabin, is_prime's gcd would only repeat the sieve
+            if miller_rabin(n) if n > SMALL_PRIMES[-1] else n in SMALL_PRIMES:
+                return n
 
 def euler(p, q):
     return (p-1) * (q-1)
@@ -26,13 +94,25 @@ def euler(p, q):
 def mod_mul_inv(a, m):
     return pow(a, -1, m)
 
-def generate_keys(bits, e=65537):
-    p = random_prime(bits//2)
-    q = random_prime(bits//2)
+def generate_keys(bits, e=65537, parallel=False):
+    if parallel:
+        # search for p and q on separate cores
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            p, q = executor.map(random_prime, [bits//2] * 2, [e] * 2)
+    else:
+        p = random_prime(bits//2, e)
+        q = random_prime(bits//2, e)
+    while p == q:
+        q = random_prime(bits//2, e)
     n = p * q
     phi = euler(p, q)
     d = mod_mul_inv(e, phi)
-    return (e, n), (d, n)
+    # CRT components let decrypt work modulo p and q separately
+    dp = d % (p-1)
+    dq = d % (q-1)
+    qinv = mod_mul_inv(q, p)
+    return (e, n), (d, n, p, q, dp, dq, qinv)
 
 def encrypt(message, public_key):
     e = public_key[0]
@@ -41,8 +121,17 @@ def encrypt(message, public_key):
     return c
 
 def decrypt(ciphertext, private_key):
+    if len(private_key) > 2:
+        return decrypt_crt(ciphertext, private_key)
     d = private_key[0]
     n = private_key[1]
     m = pow(ciphertext, d, n)
     return m
 
+def decrypt_crt(ciphertext, private_key):
+    d, n, p, q, dp, dq, qinv = private_key
+    m1 = pow(ciphertext, dp, p)
+    m2 = pow(ciphertext, dq, q)
+    h = (qinv * (m1 - m2)) % p
+    return m2 + h * q
+
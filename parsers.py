@@ -0,0 +1,214 @@
+import collections
+import functools
+import zlib
+
+# chunk decoders, keyed by chunk type, see decode()
+DECODERS = {}
+
+# what a decoder raises on a malformed chunk
+DECODE_ERRORS = (IndexError, ValueError, zlib.error)
+
+
+def decoder(name):
+  def register(func):
+    DECODERS[name] = func
+    return func
+  return register
+
+
+def decode(name, chunk_data, header=None):
+  """Typed record of a chunk's data, None for chunk types without a decoder.
+
+  header is the IHDR record, tRNS needs its color type to be read.
+  """
+  decode_chunk = DECODERS.get(name)
+  if decode_chunk is None:
+    return None
+  return decode_chunk(bytes(chunk_data), header)
+
+
+def split_keyword(data, encoding="latin-1"):
+  end = data.index(0)
+  return data[:end].decode(encoding), data[end+1:]
+
+
+IHDR = collections.namedtuple("IHDR", "width height bit_depth color_type compression_method filter_method interlace_method")
+
+PLTE = collections.namedtuple("PLTE", "colors")
+
+# alpha is a sample value for grayscale, an (r, g, b) sample for truecolor
+# and one alpha value per palette entry for indexed images
+tRNS = collections.namedtuple("tRNS", "color_type alpha")
+
+ICCProfile = collections.namedtuple("ICCProfile", "profile_size cmm_type version device_class color_space "
+                                    "connection_space date time signature platform manufacturer device_model")
+
+tEXt = collections.namedtuple("tEXt", "keyword text")
+
+gAMA = collections.namedtuple("gAMA", "gamma")
+
+pHYs = collections.namedtuple("pHYs", "x_per_unit y_per_unit unit")
+
+tIME = collections.namedtuple("tIME", "year month day hour minute second")
+
+sRGB = collections.namedtuple("sRGB", "rendering_intent")
+
+# tags are the (tag, type, count, value or offset) entries of the first IFD
+eXIf = collections.namedtuple("eXIf", "byte_order tags")
+
+
+class iCCP(collections.namedtuple("iCCP", "profile_name compression_method compressed_profile")):
+  """The profile itself is only inflated by profile()."""
+  __slots__ = ()
+
+  def profile(self):
+    return parse_icc_header(self.compressed_profile)
+
+
+class zTXt(collections.namedtuple("zTXt", "keyword compression_method compressed_text")):
+  __slots__ = ()
+
+  def text(self):
+    return zlib.decompress(self.compressed_text).decode("latin-1")
+
+
+class iTXt(collections.namedtuple("iTXt", "keyword compression_flag compression_method language_tag translated_keyword raw_text")):
+  __slots__ = ()
+
+  def text(self):
+    raw_text = zlib.decompress(self.raw_text) if self.compression_flag else self.raw_text
+    return raw_text.decode("utf-8")
+
+
+@decoder("IHDR")
+def decode_IHDR(data, header=None):
+  if len(data) < 13:
+    raise ValueError("IHDR chunk is too short.")
+  return IHDR(int.from_bytes(data[0:4], byteorder="big"), int.from_bytes(data[4:8], byteorder="big"), *data[8:13])
+
+
+@decoder("PLTE")
+def decode_PLTE(data, header=None):
+  return PLTE(tuple(zip(data[0::3], data[1::3], data[2::3])))
+
+
+@decoder("tRNS")
+def decode_tRNS(data, header=None):
+  color_type = header.color_type if header is not None else None
+  if color_type == 0:
+    return tRNS(color_type, int.from_bytes(data[0:2], byteorder="big"))
+  if color_type == 2:
+    return tRNS(color_type, tuple(int.from_bytes(data[i:i+2], byteorder="big") for i in (0, 2, 4)))
+  return tRNS(color_type, tuple(data))
+
+
+@decoder("iCCP")
+def decode_iCCP(data, header=None):
+  profile_name, rest = split_keyword(data)
+  return iCCP(profile_name, rest[0], rest[1:])
+
+
+@decoder("tEXt")
+def decode_tEXt(data, header=None):
+  keyword, text = split_keyword(data)
+  return tEXt(keyword, text.decode("latin-1"))
+
+
+@decoder("zTXt")
+def decode_zTXt(data, header=None):
+  keyword, rest = split_keyword(data)
+  return zTXt(keyword, rest[0], rest[1:])
+
+
+@decoder("iTXt")
+def decode_iTXt(data, header=None):
+  keyword, rest = split_keyword(data)
+  compression_flag, compression_method = rest[0], rest[1]
+  language_tag, rest = split_keyword(rest[2:])
+  translated_keyword, raw_text = split_keyword(rest, "utf-8")
+  return iTXt(keyword, compression_flag, compression_method, language_tag, translated_keyword, raw_text)
+
+
+@decoder("gAMA")
+def decode_gAMA(data, header=None):
+  return gAMA(int.from_bytes(data[0:4], byteorder="big") / 100000)
+
+
+@decoder("pHYs")
+def decode_pHYs(data, header=None):
+  if len(data) < 9:
+    raise ValueError("pHYs chunk is too short.")
+  return pHYs(int.from_bytes(data[0:4], byteorder="big"), int.from_bytes(data[4:8], byteorder="big"), data[8])
+
+
+@decoder("tIME")
+def decode_tIME(data, header=None):
+  if len(data) < 7:
+    raise ValueError("tIME chunk is too short.")
+  return tIME(int.from_bytes(data[0:2], byteorder="big"), *data[2:7])
+
+
+@decoder("sRGB")
+def decode_sRGB(data, header=None):
+  return sRGB(data[0])
+
+
+@decoder("eXIf")
+def decode_eXIf(data, header=None):
+  if data[0:2] not in (b"MM", b"II"):
+    raise ValueError("Bad eXIf byte order mark.")
+  byte_order = "big" if data[0:2] == b"MM" else "little"
+  read = lambda start, size: int.from_bytes(data[start:start+size], byteorder=byte_order)
+  offset = read(4, 4)
+  count = read(offset, 2)
+  if offset + 2 + 12 * count > len(data):
+    raise ValueError("eXIf chunk is truncated.")
+  tags = []
+  for i in range(offset + 2, offset + 2 + 12 * count, 12):
+    field_type, field_count = read(i+2, 2), read(i+4, 4)
+    # a single SHORT sits in the first half of the value field
+    value = read(i+8, 2) if field_type == 3 and field_count == 1 else read(i+8, 4)
+    tags.append((read(i, 2), field_type, field_count, value))
+  return eXIf(byte_order, tuple(tags))
+
+
+@functools.lru_cache(maxsize=32)
+def parse_icc_header(compressed_profile):
+  icc_profile = zlib.decompress(compressed_profile)
+
+  v = list(hex(int.from_bytes(icc_profile[8:12], byteorder="big", signed=False)))
+  year = int.from_bytes(icc_profile[24:26], byteorder="big", signed=False)
+  month = int.from_bytes(icc_profile[26:28], byteorder="big", signed=False)
+  day = int.from_bytes(icc_profile[28:30], byteorder="big", signed=False)
+  hour = int.from_bytes(icc_profile[30:32], byteorder="big", signed=False)
+  minute = int.from_bytes(icc_profile[32:34], byteorder="big", signed=False)
+  second = int.from_bytes(icc_profile[34:36], byteorder="big", signed=False)
+  return ICCProfile(
+    profile_size=int.from_bytes(icc_profile[0:4], byteorder="big", signed=False),
+    cmm_type=icc_profile[4:8].decode('utf-8'),
+    version=f"{v[2]}.{v[3]}",
+    device_class=icc_profile[12:16].decode('utf-8'),
+    color_space=icc_profile[16:20].decode('utf-8'),
+    connection_space=icc_profile[20:24].decode('utf-8'),
+    date=f"{day:02}-{month:02}-{year}",
+    time=f"{hour:02}:{minute:02}:{second:02}",
+    signature=icc_profile[36:40].decode('utf-8'),
+    platform=icc_profile[40:44].decode('utf-8'),
+    manufacturer=icc_profile[48:52].decode('utf-8'),
+    device_model=icc_profile[52:56].decode('utf-8'),
+  )
+
+
+# plain dict and list forms of the records, for the JSON index cache and scan records
+
+def parse_IHDR(chunk_data):
+  return decode_IHDR(bytes(chunk_data))._asdict()
+
+
+def parse_PLTE(chunk_data):
+  return list(decode_PLTE(bytes(chunk_data)).colors)
+
+
+def parse_iCCP(chunk_data):
+  record = decode_iCCP(bytes(chunk_data))
+  return {"profile_name": record.profile_name, **record.profile()._asdict()}
@@ -0,0 +1,71 @@
+from chunk import Chunk
+
+
+PNG_SIGNATURE = bytes([137, 80, 78, 71, 13, 10, 26, 10])
+
+
+def read_exact(read, size):
+  # pipes and sockets may return fewer bytes than asked for
+  parts = []
+  while size > 0:
+    part = read(size)
+    if not part:
+      break
+    parts.append(part)
+    size -= len(part)
+  return b"".join(parts)
+
+
+def skip(stream, read, size, buffer_size):
+  try:
+    if stream.seekable():
+      stream.seek(size, 1)
+      return True
+  except AttributeError:
+    pass
+  while size > 0:
+    part = read(min(size, buffer_size))
+    if not part:
+      return False
+    size -= len(part)
+  return True
+
+
+def iter_chunks(stream, names=None, buffer_size=65536):
+  """Yields (Chunk, payload) pairs read from a binary stream.
+
+  Only the payloads of chunks listed in names are read into memory (all of
+  them when names is None), the others are seeked over or drained in
+  buffer_size pieces and yielded with a None payload. Works with file
+  objects, pipes and anything with a read() or recv() method. Raises
+  ValueError on a bad signature or a truncated stream.
+  """
+  read = getattr(stream, "read", None) or stream.recv
+  if read_exact(read, 8) != PNG_SIGNATURE:
+    raise ValueError("Bad png file signature.")
+  start = 8
+  while True:
+    header = read_exact(read, 8)
+    if not header:
+      return
+    if len(header) < 8:
+      raise ValueError("Unexpected end of stream.")
+    datasize = int.from_bytes(header[0:4], byteorder="big", signed=False)
+    name = header[4:8].decode("latin-1")
+    chunk = Chunk(start, name, datasize)
+    if names is None or name in names:
+      payload = read_exact(read, datasize)
+      if len(payload) < datasize:
+        raise ValueError("Unexpected end of stream.")
+    else:
+      payload = None
+      if not skip(stream, read, datasize, buffer_size):
+        raise ValueError("Unexpected end of stream.")
+    crc = read_exact(read, 4)
+    if len(crc) < 4:
+      raise ValueError("Unexpected end of stream.")
+    chunk.crc = int.from_bytes(crc, byteorder="big", signed=False)
+    yield chunk, payload
+    start = start + 8 + datasize + 4
+    if name == "IEND":
+      return
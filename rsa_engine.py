@@ -0,0 +1,56 @@
+import collections
+import itertools
+import os
+
+import myrsa
+
+
+BATCH_SIZE = 256
+MIN_PARALLEL_BLOCKS = 2 * BATCH_SIZE
+
+
+def run_batch(func, values, key):
+  return [func(value, key) for value in values]
+
+
+def iter_batches(values, batch_size):
+  values = iter(values)
+  while True:
+    batch = list(itertools.islice(values, batch_size))
+    if not batch:
+      return
+    yield batch
+
+
+def map_blocks(func, values, key, workers=None, batch_size=BATCH_SIZE):
+  """Yields func(value, key) for every block, in order, using a process pool.
+
+  Blocks are sent to the workers in batches of batch_size to amortise the
+  pickling of the key and the results, and at most two batches per worker
+  are in flight, so values can be a stream. Small inputs and workers=1
+  run in-process.
+  """
+  values = iter(values)
+  workers = workers or os.cpu_count() or 1
+  head = list(itertools.islice(values, MIN_PARALLEL_BLOCKS))
+  if workers == 1 or len(head) < MIN_PARALLEL_BLOCKS:
+    for batch in iter_batches(itertools.chain(head, values), batch_size):
+      yield from run_batch(func, batch, key)
+    return
+  from concurrent.futures import ProcessPoolExecutor
+  with ProcessPoolExecutor(max_workers=workers) as executor:
+    pending = collections.deque()
+    for batch in iter_batches(itertools.chain(head, values), batch_size):
+      pending.append(executor.submit(run_batch, func, batch, key))
+      if len(pending) >= 2 * workers:
+        yield from pending.popleft().result()
+    while pending:
+      yield from pending.popleft().result()
+
+
+def encrypt_blocks(messages, public_key, workers=None):
+  return map_blocks(myrsa.encrypt, messages, public_key, workers)
+
+
+def decrypt_blocks(ciphertexts, private_key, workers=None):
+  return map_blocks(myrsa.decrypt, ciphertexts, private_key, workers)
@@ -0,0 +1,131 @@
+import collections
+import functools
+import os
+import threading
+
+
+@functools.lru_cache(maxsize=None)
+def fft_backend():
+  # numpy and the FFT libraries are only imported for the first transform
+  try:
+    import scipy.fft
+    return "scipy", scipy.fft
+  except ImportError:
+    pass
+  try:
+    import pyfftw.interfaces.numpy_fft
+    return "pyfftw", pyfftw.interfaces.numpy_fft
+  except ImportError:
+    import numpy as np
+    return "numpy", np.fft
+
+
+def rfft2(samples):
+  backend, module = fft_backend()
+  if backend == "scipy":
+    return module.rfft2(samples, workers=-1)
+  if backend == "pyfftw":
+    return module.rfft2(samples, threads=os.cpu_count() or 1)
+  return module.rfft2(samples)
+
+
+def file_key(filepath):
+  """Identity of a file's current contents: path, mtime and size."""
+  st = os.stat(filepath)
+  return os.path.abspath(filepath), st.st_mtime_ns, st.st_size
+
+
+def to_luminance(pixels, resize):
+  import numpy as np
+  from PIL import Image
+  img = Image.fromarray(pixels).convert("L")
+  width, height = img.size
+  new_width, new_height = resize
+  scale = min(new_height/height, new_width/width)
+  dimensions = (max(1, int(width*scale)), max(1, int(height*scale)))
+  return np.asarray(img.resize(dimensions, Image.BILINEAR))
+
+
+class Spectrum:
+  """Spectrum of a real image, stored as the half plane rfft2 returns.
+
+  The missing half follows from Hermitian symmetry, X[-u, -v] equals
+  conj(X[u, v]), so the centered magnitude and phase planes are mirrored
+  out of the half plane instead of running a full complex fft2. Each is
+  computed once, on first use.
+  """
+  def __init__(self, half, width):
+    self.half = half
+    self.width = width
+    self.views = {}
+
+  def mirror(self, values, conjugate):
+    import numpy as np
+    # columns past width // 2 are the conjugates of mirrored columns of the half plane
+    height = self.half.shape[0]
+    full = np.empty((height, self.width), dtype=values.dtype)
+    half_width = values.shape[1]
+    full[:, :half_width] = values
+    rows = (-np.arange(height)) % height
+    cols = self.width - np.arange(half_width, self.width)
+    full[:, half_width:] = conjugate(values[rows][:, cols])
+    return np.fft.fftshift(full)
+
+  def magnitude(self):
+    import numpy as np
+    if "magnitude" not in self.views:
+      self.views["magnitude"] = self.mirror(np.abs(self.half), lambda values: values)
+    return self.views["magnitude"]
+
+  def log_magnitude(self):
+    import numpy as np
+    if "log_magnitude" not in self.views:
+      with np.errstate(divide="ignore"):
+        self.views["log_magnitude"] = 20*np.log(self.magnitude())
+    return self.views["log_magnitude"]
+
+  def phase(self):
+    import numpy as np
+    if "phase" not in self.views:
+      self.views["phase"] = np.angle(self.mirror(self.half, np.conj))
+    return self.views["phase"]
+
+
+class SpectrumEngine:
+  """LRU cache of image spectra keyed by file identity and resolution.
+
+  The Magnitude/Phase switch and reopening an unchanged file reuse the
+  cached transform, only a new file or a new resolution runs an FFT.
+  """
+  def __init__(self, max_entries=16):
+    self.max_entries = max_entries
+    self.entries = collections.OrderedDict()
+    self.lock = threading.Lock()
+
+  def compute(self, pixels, resize=(500, 500)):
+    samples = to_luminance(pixels, resize)
+    return Spectrum(rfft2(samples.astype("float64")), samples.shape[1])
+
+  def lookup(self, key, resize=(500, 500)):
+    with self.lock:
+      spectrum = self.entries.get((key, tuple(resize)))
+      if spectrum is not None:
+        self.entries.move_to_end((key, tuple(resize)))
+      return spectrum
+
+  def get(self, key, pixels, resize=(500, 500)):
+    if key is None:
+      return self.compute(pixels, resize)
+    spectrum = self.lookup(key, resize)
+    if spectrum is not None:
+      return spectrum
+    spectrum = self.compute(pixels, resize)
+    with self.lock:
+      self.entries[(key, tuple(resize))] = spectrum
+      while len(self.entries) > self.max_entries:
+        self.entries.popitem(last=False)
+    return spectrum
+
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
@@ -0,0 +1,61 @@
+import os
+
+from reader import iter_chunks
+
+
+def copy_span(src_fd, dst_fd, offset, count):
+  # let the kernel move the bytes, falling back to pread/write where it can't
+  while count > 0:
+    copied = 0
+    try:
+      if hasattr(os, "copy_file_range"):
+        copied = os.copy_file_range(src_fd, dst_fd, count, offset)
+      else:
+        copied = os.sendfile(dst_fd, src_fd, offset, count)
+    except OSError:
+      pass
+    if copied <= 0:
+      block = os.pread(src_fd, min(count, 1 << 20), offset)
+      if not block:
+        raise IOError("Unexpected end of file.")
+      copied = os.write(dst_fd, block)
+    offset += copied
+    count -= copied
+
+
+def strip_metadata(src, dst, allow=()):
+  """Copies the png file src to dst without its ancillary chunks.
+
+  Ancillary chunks whose names are in allow are kept. Only chunk headers
+  are read through Python, the kept spans are copied file to file.
+  Returns the list of dropped chunks, empty when there were none, or None
+  when src couldn't be stripped.
+  """
+  if os.path.exists(dst) and os.path.samefile(src, dst):
+    print("Cannot strip metadata in place, choose another output file.")
+    return None
+  try:
+    with open(src, "rb") as src_file:
+      chunks = [chunk for chunk, _ in iter_chunks(src_file, names=())]
+  except (IOError, ValueError) as e:
+    print("Could not strip metadata from", src, "-", e)
+    return None
+
+  spans = [[0, 8]]
+  dropped = []
+  for chunk in chunks:
+    if chunk.is_ancillary() and chunk.name not in allow:
+      dropped.append(chunk)
+      continue
+    end = chunk.start + 8 + chunk.datasize + 4
+    if spans[-1][1] == chunk.start:
+      spans[-1][1] = end
+    else:
+      spans.append([chunk.start, end])
+
+  with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+    for start, end in spans:
+      copy_span(src_file.fileno(), dst_file.fileno(), start, end - start)
+  for chunk in dropped:
+    print("Chunk", chunk.name, "deleted successfully.")
+  return dropped
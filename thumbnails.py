@@ -0,0 +1,195 @@
+import collections
+import hashlib
+import io
+import os
+import threading
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+import instrument
+
+
+DEFAULT_THUMBNAIL_FOLDER = os.path.join(os.path.expanduser("~"), ".png_inspector", "thumbnails")
+
+
+class ThumbnailCache:
+  """PNG encoded previews of image files, cached in memory and on disk.
+
+  Thumbnails are keyed by path, mtime, size and resolution, so an edited
+  file gets a fresh one. Both levels are LRU with a byte budget: the
+  memory level evicts on insertion, the disk level evicts the files with
+  the oldest mtime (refreshed on every hit) once it grows past its
+  budget. prefetch() renders thumbnails on a background pool ahead of
+  time, a newer prefetch cancels what an older one has not started yet.
+  Prefetching renders with PIL; the loader, which decodes the selected
+  image anyway, stores its thumbnail from those pixels with store_pixels().
+  """
+  def __init__(self, folder=DEFAULT_THUMBNAIL_FOLDER, memory_budget=64 << 20, disk_budget=512 << 20, workers=2):
+    self.folder = folder
+    self.memory_budget = memory_budget
+    self.disk_budget = disk_budget
+    os.makedirs(folder, exist_ok=True)
+    self.memory = collections.OrderedDict()
+    self.memory_size = 0
+    self.disk_size = sum(entry.stat().st_size for entry in os.scandir(folder) if entry.name.endswith(".png"))
+    self.lock = threading.Lock()
+    self.pending = {}
+    self.prefetched = []
+    self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbnails")
+
+  def key(self, filepath, resize):
+    st = os.stat(filepath)
+    identity = f"{os.path.abspath(filepath)}\0{st.st_mtime_ns}\0{st.st_size}\0{resize[0]}x{resize[1]}"
+    return hashlib.sha1(identity.encode("utf-8")).hexdigest()
+
+  def disk_path(self, key):
+    return os.path.join(self.folder, key + ".png")
+
+  def lookup(self, key):
+    with self.lock:
+      data = self.memory.get(key)
+      if data is not None:
+        self.memory.move_to_end(key)
+        return data
+    path = self.disk_path(key)
+    try:
+      with open(path, "rb") as f:
+        data = f.read()
+      os.utime(path)
+    except OSError:
+      return None
+    self.remember(key, data)
+    return data
+
+  def remember(self, key, data):
+    with self.lock:
+      if key in self.memory:
+        return
+      self.memory[key] = data
+      self.memory_size += len(data)
+      while self.memory_size > self.memory_budget and len(self.memory) > 1:
+        _, evicted = self.memory.popitem(last=False)
+        self.memory_size -= len(evicted)
+
+  def store(self, key, data):
+    self.remember(key, data)
+    path = self.disk_path(key)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    try:
+      with open(tmp_path, "wb") as f:
+        f.write(data)
+      os.replace(tmp_path, path)
+    except OSError:
+      return
+    with self.lock:
+      self.disk_size += len(data)
+      over_budget = self.disk_size > self.disk_budget
+    if over_budget:
+      self.evict_disk()
+
+  def evict_disk(self):
+    # down to 90% of the budget so that eviction doesn't run on every store
+    entries = sorted((entry for entry in os.scandir(self.folder) if entry.name.endswith(".png")),
+                     key=lambda entry: entry.stat().st_mtime)
+    total = sum(entry.stat().st_size for entry in entries)
+    for entry in entries:
+      if total <= self.disk_budget * 0.9:
+        break
+      try:
+        size = entry.stat().st_size
+        os.remove(entry.path)
+        total -= size
+      except OSError:
+        pass
+    with self.lock:
+      self.disk_size = total
+
+  @instrument.timed("thumbnails.render")
+  def render(self, image, resize):
+    from PIL import Image
+    # scaled to fit, small images are enlarged
+    width, height = image.size
+    scale = min(resize[1]/height, resize[0]/width)
+    image = image.resize((max(1, int(width*scale)), max(1, int(height*scale))), Image.LANCZOS)
+    bio = io.BytesIO()
+    image.save(bio, format="PNG")
+    instrument.count(bytes=bio.tell())
+    return bio.getvalue()
+
+  def render_file(self, filepath, resize):
+    from PIL import Image
+    image = Image.open(filepath)
+    if image.mode.startswith("I"):
+      # 16 bit grayscale, keep the high byte like the decoder's as_uint8
+      image = image.convert("I").point(lambda value: value / 256).convert("L")
+    elif image.mode not in ("L", "LA", "RGB", "RGBA"):
+      has_alpha = "A" in image.getbands() or "transparency" in image.info
+      image = image.convert("RGBA" if has_alpha else "RGB")
+    return self.render(image, resize)
+
+  def store_pixels(self, key, pixels, resize):
+    """Renders and stores the thumbnail of already decoded pixels."""
+    from PIL import Image
+    data = self.render(Image.fromarray(pixels), resize)
+    self.store(key, data)
+    return data
+
+  def cached(self, key):
+    """Returns the thumbnail stored under key, waiting for a running
+    prefetch of it, or None when it would have to be rendered.
+    """
+    data = self.lookup(key)
+    if data is not None:
+      return data
+    with self.lock:
+      future = self.pending.get(key)
+    if future is None:
+      return None
+    try:
+      return future.result()
+    except CancelledError:
+      # a newer prefetch() cancelled it after it was looked up
+      return None
+
+  def thumbnail(self, filepath, resize=(500, 500)):
+    """Returns the thumbnail of filepath, rendering it if it isn't cached."""
+    key = self.key(filepath, resize)
+    data = self.cached(key)
+    if data is None:
+      data = self.render_file(filepath, resize)
+      self.store(key, data)
+    return data
+
+  def prefetch_one(self, key, filepath, resize):
+    try:
+      data = self.lookup(key)
+      if data is None:
+        data = self.render_file(filepath, resize)
+        self.store(key, data)
+      return data
+    except Exception:
+      return None
+    finally:
+      with self.lock:
+        self.pending.pop(key, None)
+
+  def prefetch(self, filepaths, resize=(500, 500)):
+    """Renders missing thumbnails in the background, in the given order."""
+    for key, future in self.prefetched:
+      if future.cancel():
+        with self.lock:
+          self.pending.pop(key, None)
+    self.prefetched = []
+    for filepath in filepaths:
+      try:
+        key = self.key(filepath, resize)
+      except OSError:
+        continue
+      with self.lock:
+        if key in self.memory or key in self.pending:
+          continue
+        future = self.executor.submit(self.prefetch_one, key, filepath, resize)
+        self.pending[key] = future
+      self.prefetched.append((key, future))
+
+  def close(self):
+    self.executor.shutdown(wait=False, cancel_futures=True)